@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from configparser import ConfigParser
+
+from nacl.encoding import Base64Encoder
+from nacl.public import PrivateKey
+from nacl.signing import SigningKey
+
+from hub import Hub
+from hub.config import KeyInterpolation, RuntimeConfig
+
+from .bridge import FakeBridge
+from .facade import Facade
+
+parser = argparse.ArgumentParser(
+    description='End-to-end load and latency benchmark for the hub'
+)
+
+parser.add_argument('--clients', '-n', dest='clients', type=int, default=10)
+parser.add_argument('--rate', '-r', dest='rate', type=float, default=30.0,
+                    help='Messages per second emitted by the fake bridge')
+parser.add_argument('--duration', '-t', dest='duration', type=float, default=10.0)
+parser.add_argument('--request-interval', dest='request_interval', type=float, default=0.5)
+parser.add_argument('--bridges', '-b', dest='bridges', type=int, default=1,
+                    help='Number of fake bridges, each emitting at the given rate and serving its own node address')
+parser.add_argument('--port', dest='port', type=int, default=23370,
+                    help='First of the local ports to use')
+parser.add_argument('--crypto-workers', dest='crypto_workers', type=int, default=0,
+                    help='Offload crypto and CBOR work to this many threads, 0 keeps it inline')
+parser.add_argument('--labels', dest='labels', default=None,
+                    help='Comma separated labels the clients subscribe to, all of them by default')
+parser.add_argument('--output', '-o', dest='output', default=None,
+                    help='Write the results as JSON to this file')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.5),
+        'p99': percentile(values, 0.99),
+        'max': max(values) if values else None,
+    }
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL) \
+            .decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_source_name(index):
+    return 'bridge' if index == 0 else 'bridge{}'.format(index)
+
+
+def get_config(args, bridges):
+    private_key = PrivateKey.generate()
+    signing_key = SigningKey.generate()
+
+    config = ConfigParser(interpolation=KeyInterpolation())
+    config.read_dict({
+        'hub': {
+            'plugins': 'p1 dht solar',
+            'sources': ' '.join(get_source_name(i) for i in range(len(bridges))),
+            # Nothing listens here, the hub keeps trying in the background
+            'upstream': 'ws://127.0.0.1:{}'.format(args.port + 2),
+        },
+        'local_auth': {'host': '127.0.0.1', 'port': str(args.port)},
+        'local_stream': {'host': '127.0.0.1', 'port': str(args.port + 1)},
+        'keys': {
+            'server_private_key': private_key.encode(Base64Encoder).decode('utf-8'),
+            'server_public_key': private_key.public_key.encode(Base64Encoder).decode('utf-8'),
+            'facade_signing_key': signing_key.encode(Base64Encoder).decode('utf-8'),
+            'facade_verify_key': signing_key.verify_key.encode(Base64Encoder).decode('utf-8'),
+        },
+    })
+    # Node 4 is where the solar plugin sends its requests, that ends up at the first bridge
+    for i, bridge in enumerate(bridges):
+        config.read_dict({get_source_name(i): {'module': 'bridge', 'url': bridge.url, 'addresses': str(4 + i)}})
+    if args.crypto_workers:
+        config.read_dict({'crypto': {'workers': str(args.crypto_workers)}})
+    return RuntimeConfig(config)
+
+
+async def run(args, loop):
+    bridges = [FakeBridge(port=args.port + 3 + i, rate=args.rate) for i in range(args.bridges)]
+    for bridge in bridges:
+        await bridge.start()
+
+    hub = Hub(get_config(args, bridges))
+    hub.add_tasks(loop)
+    await asyncio.sleep(0.5)
+
+    facades = [
+        Facade(
+            'ws://127.0.0.1:{}'.format(args.port),
+            'ws://127.0.0.1:{}'.format(args.port + 1),
+            request_interval=args.request_interval,
+            labels=args.labels.split(',') if args.labels else None,
+        )
+        for _ in range(args.clients)
+    ]
+    tasks = [asyncio.ensure_future(facade.run()) for facade in facades]
+
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+
+    # Anything that stopped on its own makes the numbers meaningless
+    failures = [
+        'facade {}: {!r}'.format(i, task.exception()) for i, task in enumerate(tasks)
+        if task.done() and not task.cancelled() and task.exception() is not None
+    ]
+    failures.extend(
+        'source {} stopped{}'.format(source_id, ': {!r}'.format(task.exception()) if not task.cancelled() else '')
+        for source_id, task in hub.source_tasks.items() if task.done()
+    )
+    # Every bridge should have been heard from, and only the one serving node 4 gets the solar requests
+    failures.extend('bridge {} emitted nothing'.format(i) for i, bridge in enumerate(bridges) if not bridge.emitted)
+    if not bridges[0].requests:
+        failures.append('bridge 0 got no requests for node 4')
+    failures.extend('bridge {} got requests for node 4'.format(i)
+                    for i, bridge in enumerate(bridges) if i and bridge.requests)
+
+    for task in tasks:
+        task.cancel()
+
+    received = sum(facade.received for facade in facades)
+    return {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'clients': args.clients,
+        'rate': args.rate,
+        'bridges': args.bridges,
+        'crypto_workers': args.crypto_workers,
+        'labels': args.labels,
+        'duration': elapsed,
+        'emitted': sum(bridge.emitted for bridge in bridges),
+        'bridge_requests': [bridge.requests for bridge in bridges],
+        'received': received,
+        'undecodable': sum(facade.undecodable for facade in facades),
+        'throughput': received / elapsed,
+        'dropped': hub.connections.dropped,
+        'coalesced': hub.connections.coalesced,
+        'broadcast_latency': summarize([i for facade in facades for i in facade.latencies]),
+        'request_round_trip': summarize([i for facade in facades for i in facade.round_trips]),
+        'failures': failures,
+    }
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run(args, loop))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if results['failures'] or not results['received']:
+        for failure in results['failures']:
+            print(failure, file=sys.stderr)
+        if not results['received']:
+            print('No broadcasts were received', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
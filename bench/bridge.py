@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+import time
+
+import flynn
+import websockets
+
+
+class FakeBridge:
+    # Stands in for the bridge: emits P1, solar and DHT messages at a fixed rate and answers requests
+
+    def __init__(self, host='127.0.0.1', port=8765, rate=10.0):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.sequence = itertools.count()
+        self.emitted = 0
+        self.requests = 0
+        self.solar = 0
+
+    @property
+    def url(self):
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+    def get_message(self, sequence):
+        kind = sequence % 3
+        if kind == 0:
+            return {'name': 'p1', 'data': {
+                'e_d_1': 1000 + sequence, 'e_d_2': 2000, 'e_r_1': 10, 'e_r_2': 20,
+                'p_d': sequence % 500, 'p_r': 0, 'g_d': 300,
+            }}
+        elif kind == 1:
+            self.solar += 1
+            return {'name': 'solar', 'data': {'solar': self.solar}}
+
+        # DHT state is broadcast as is, so it carries what the facades need to measure latency. Only ints,
+        # flynn can't decode floats: tenths of a degree and a nanosecond clock.
+        return {'name': 'dht', 'data': {
+            'temperature': 205, 'humidity': 40, 'sequence': sequence, 'emitted': time.perf_counter_ns(),
+        }}
+
+    async def emit(self, bridge):
+        interval = 1 / self.rate
+        while True:
+            await bridge.send(flynn.dumps(self.get_message(next(self.sequence))))
+            self.emitted += 1
+            await asyncio.sleep(interval)
+
+    async def answer(self, bridge):
+        while True:
+            message = flynn.loads(await bridge.recv())
+            self.requests += 1
+            if message['name'].startswith('solar.'):
+                await bridge.send(flynn.dumps({'id': message['id'], 'data': {'solar': self.solar}}))
+            else:
+                await bridge.send(flynn.dumps({'id': message['id'], 'data': {}}))
+
+    # noinspection PyUnusedLocal
+    async def handle(self, bridge, path=None):
+        tasks = [asyncio.ensure_future(self.emit(bridge)), asyncio.ensure_future(self.answer(bridge))]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def start(self):
+        server = await websockets.serve(self.handle, self.host, self.port)
+        # With port 0 the system picks one
+        self.port = server.sockets[0].getsockname()[1]
+        return server
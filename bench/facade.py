@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import flynn
+import nacl.utils
+import websockets
+from nacl.public import Box, PrivateKey, PublicKey
+from nacl.secret import SecretBox
+from websockets.exceptions import ConnectionClosed
+
+
+class Facade:
+    # A simulated client going through local_auth and local_stream like a real facade does
+
+    def __init__(self, auth_url, stream_url, request_interval=1.0, labels=None):
+        self.auth_url = auth_url
+        self.stream_url = stream_url
+        self.request_interval = request_interval
+        self.labels = labels
+        self.private_key = PrivateKey.generate()
+
+        self.signature = None
+        self.server_key = None
+        self.box = None
+        self.broadcast_box = None
+        self.group_boxes = {}
+
+        self.received = 0
+        self.undecodable = 0
+        self.latencies = []
+        self.round_trips = []
+        self.requested = []
+
+    async def authenticate(self):
+        async with websockets.connect(self.auth_url) as auth:
+            await auth.send(self.private_key.public_key.encode())
+            reply = flynn.loads(await auth.recv())
+
+        self.signature = reply['signature']
+        self.server_key = PublicKey(reply['key'])
+        self.box = Box(self.private_key, self.server_key)
+        self.broadcast_box = SecretBox(bytes(self.server_key))
+
+    def get_request(self, request):
+        nonce = nacl.utils.random(Box.NONCE_SIZE)
+        return flynn.dumps({
+            'key': self.private_key.public_key.encode(),
+            'verification': self.signature,
+            'nonce': nonce,
+            'payload': self.box.encrypt(flynn.dumps(request), nonce).ciphertext,
+        })
+
+    async def send_requests(self, stream):
+        if self.labels is not None:
+            await stream.send(self.get_request({'target': 'hub', 'command': 'subscribe', 'labels': self.labels}))
+
+        while True:
+            self.requested.append(time.perf_counter_ns())
+            await stream.send(self.get_request('hello'))
+            await asyncio.sleep(self.request_interval)
+
+    def open(self, box, message):
+        try:
+            return flynn.loads(box.decrypt(message['payload'], message['nonce']))
+        except AttributeError:
+            # flynn fails this way on floats, which plugins like p1 do send
+            self.undecodable += 1
+            return None
+
+    def handle_frame(self, frame):
+        now = time.perf_counter_ns()
+        message = flynn.loads(frame)
+
+        if 'key' in message:  # reply
+            payload = self.open(self.box, message)
+            if payload == 'hello' and self.requested:
+                self.round_trips.append((now - self.requested.pop(0)) / 1e9)
+            elif isinstance(payload, dict) and payload.get('label') == 'hub' and 'key' in payload.get('data', {}):
+                self.group_boxes[payload['data']['group']] = SecretBox(payload['data']['key'])
+        else:
+            if 'group' in message:
+                # Broadcasts can overtake the reply carrying the key of a new subscription
+                box = self.group_boxes.get(message['group'])
+                if box is None:
+                    return
+            else:
+                box = self.broadcast_box
+
+            payload = self.open(box, message)
+            if payload is None:
+                return
+            self.received += 1
+            data = payload.get('data') or payload.get('delta') or {}
+            if payload.get('label') == 'dht' and 'emitted' in data:
+                self.latencies.append((now - data['emitted']) / 1e9)
+
+    async def run(self):
+        await self.authenticate()
+        async with websockets.connect(self.stream_url) as stream:
+            requests = asyncio.ensure_future(self.send_requests(stream))
+            try:
+                while True:
+                    self.handle_frame(await stream.recv())
+            except ConnectionClosed:
+                pass
+            finally:
+                requests.cancel()
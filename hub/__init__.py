@@ -1,54 +1,259 @@
 import asyncio
+import configparser
 import importlib
+import logging
+import signal
 import ssl
+import time
+from collections import deque
 
 import flynn
 import nacl.utils
 import websockets
 from flynn.decoder import InvalidCborError
-from nacl.exceptions import CryptoError, BadSignatureError
+from nacl.encoding import Base64Encoder
+from nacl.exceptions import CryptoError
 from nacl.public import PublicKey, Box
 from nacl.secret import SecretBox
 from websockets.exceptions import ConnectionClosed, InvalidHandshake
 
+from .config import Section
+from .crypto import BoxCache, CryptoExecutor, GroupKeys, VerificationCache
+from .fanout import FanOut
+from .scheduler import RequestScheduler
+from . import cbor, metrics, state, store, upstream
+
+logger = logging.getLogger(__name__)
+
+# Read once at startup, a reload only picks up the options listed in RELOADABLE_OPTIONS
+RESTART_SECTIONS = ('hub', 'keys', 'crypto', 'store', 'state', 'metrics', 'tls', 'local_auth', 'local_stream',
+                    'upstream')
+RELOADABLE_OPTIONS = {
+    'hub': ('plugins', 'sources'),
+    'keys': ('admin_public_keys',),
+}
+
 
 class Hub:
     sources = None
     plugins = None
+    routes = None
     connections = None
+    store = None
+    state = None
 
     requests = asyncio.Queue()
     incoming = asyncio.Queue()
 
     def __init__(self, config):
         self.config = config
-        self.connections = set()
+
+        # Snapshot versions are only comparable within one run of the hub
+        self.epoch = int(time.time() * 1000)
+        self.snapshot_cache = None
+
+        if 'metrics' in config:
+            self.metrics = metrics.from_config(config['metrics'])
+        else:
+            self.metrics = metrics.Metrics()
+
+        self.connections = FanOut(config['hub'].getint('send_queue', 64))
+
+        self.boxes = BoxCache(config['keys']['server_private_key'], config['hub'].getint('box_cache', 128))
+        self.broadcast_box = SecretBox(bytes(config['keys']['server_public_key']))
+        self.group_keys = GroupKeys(config['keys']['server_private_key'])
+        self.verifications = VerificationCache(
+            config['keys']['facade_signing_key'].verify_key,
+            config['hub'].getint('verify_ttl', 300),
+        )
+
+        self.crypto = CryptoExecutor()
+        if 'crypto' in config:
+            self.crypto = CryptoExecutor(
+                workers=config['crypto'].getint('workers', 4),
+                batch_size=config['crypto'].getint('batch_size', 32),
+            )
+
+        if 'store' in config:
+            self.store = store.from_config(config['store'])
+
+        self.scheduler = RequestScheduler(
+            self.handle_request,
+            workers=config['hub'].getint('request_workers', 4),
+            long_running=config['hub'].getint('long_requests', 1),
+        )
 
         self.sources = dict()
+        self.source_tasks = dict()
+        self.source_gauges = dict()
         for source_name in config['hub'].get('sources', '').split():
             source = self._get_module(config, source_name, module_type='sources')
             if source:
                 self.sources[source.id] = source
 
+        self.address_routes = self.get_address_routes()
+
         self.plugins = dict()
         for plugin_name in config['hub'].get('plugins', '').split():
-            plugin = self._get_module(config, plugin_name, module_type='plugins')
+            plugin = self.get_plugin(plugin_name)
             if plugin:
                 self.plugins[plugin.id] = plugin
 
-    def _get_module(self, config, module_name, module_type=None):
+        # Restored before anything listens, so the first clients already get a useful snapshot
+        if 'state' in config:
+            self.state = state.from_config(config['state'])
+            self.state.restore(self.plugins)
+
+        self.handlers = set()
+        # Source messages waiting per plugin, each drained in order by a worker of its own
+        self.inboxes = dict()
+        self.inbox_size = config['hub'].getint('incoming_queue', 256)
+        self.incoming_dropped = 0
+        self.routes = self.get_routes()
+
+        self.add_gauges()
+
+    def _get_module(self, config, module_name, module_type=None, reload=False):
         import_module = module_name
 
         if config.has_section(module_name):
             config = config[module_name]
             import_module = config.get('module', module_name)
+        else:
+            config = Section(module_name, {}, {})
 
         if '.' not in import_module:
             import_module = "hub.{}.{}".format(module_type, import_module)
         module = importlib.import_module(import_module)
+        if reload:
+            module = importlib.reload(module)
 
         return module.from_config(module_name, config, self)
 
+    def get_plugin(self, plugin_name, reload=False):
+        plugin = self._get_module(self.config, plugin_name, module_type='plugins', reload=reload)
+        if plugin:
+            if self.config.has_section(plugin_name):
+                plugin.configure(self.config[plugin_name])
+            self.connections.set_policy(plugin.label, plugin.overflow)
+        return plugin
+
+    def start_source(self, source):
+        self.source_tasks[source.id] = asyncio.ensure_future(source.get_task(self))
+        self.metrics.gauge('source_outgoing_depth', source.outgoing.qsize, source=source.id)
+
+        self.source_gauges[source.id] = ['source_{}'.format(name) for name in source.stats()]
+        for name in source.stats():
+            self.metrics.gauge('source_{}'.format(name), lambda name=name: source.stats()[name], source=source.id)
+
+    def stop_source(self, source_id):
+        task = self.source_tasks.pop(source_id, None)
+        if task is not None:
+            task.cancel()
+        self.metrics.remove_gauge('source_outgoing_depth', source=source_id)
+        for name in self.source_gauges.pop(source_id, ()):
+            self.metrics.remove_gauge(name, source=source_id)
+
+    def get_restart_options(self):
+        options = dict()
+        for name in RESTART_SECTIONS:
+            if name in self.config:
+                options[name] = dict((option, value) for option, value in self.config[name].raw.items()
+                                     if option not in RELOADABLE_OPTIONS.get(name, ()))
+        return options
+
+    def reload(self):
+        # Rebuilds what changed in the config, connections and everything else stay as they are
+        plugin_names = self.config['hub'].get('plugins', '').split()
+        source_names = self.config['hub'].get('sources', '').split()
+        restart_options = self.get_restart_options()
+        try:
+            changed = self.config.reload()
+        except (OSError, ValueError, configparser.Error):
+            logger.exception('Could not reload the config, keeping the current one')
+            return None
+
+        new_restart_options = self.get_restart_options()
+        for name in RESTART_SECTIONS:
+            if restart_options.get(name) != new_restart_options.get(name):
+                logger.warning('Changes to [%s] take effect after a restart', name)
+
+        reloaded = set()
+        # Sources that were stopped, plugins depending on them are rebuilt
+        replaced = set()
+
+        new_source_names = self.config['hub'].get('sources', '').split()
+        for source_name in set(source_names) - set(new_source_names):
+            self.stop_source(source_name)
+            self.sources.pop(source_name, None)
+            replaced.add(source_name)
+            reloaded.add(source_name)
+
+        for source_name in new_source_names:
+            if source_name in self.sources and source_name not in changed:
+                continue
+            try:
+                source = self._get_module(self.config, source_name, module_type='sources', reload=True)
+            except Exception:
+                logger.exception('Could not reload source %s', source_name)
+                continue
+
+            if source_name in self.sources:
+                self.stop_source(source_name)
+                replaced.add(source_name)
+            self.sources[source.id] = source
+            self.start_source(source)
+            reloaded.add(source_name)
+
+        try:
+            self.address_routes = self.get_address_routes()
+        except ValueError:
+            logger.exception('Could not update the address routes, keeping the current ones')
+
+        new_plugin_names = self.config['hub'].get('plugins', '').split()
+        for plugin_name in set(plugin_names) - set(new_plugin_names):
+            plugin = self.plugins.pop(plugin_name, None)
+            if plugin is not None and plugin.pending_handle is not None:
+                plugin.pending_handle.cancel()
+            reloaded.add(plugin_name)
+
+        for plugin_name in new_plugin_names:
+            current = self.plugins.get(plugin_name)
+            # Plugins holding on to a replaced source need to be rebuilt as well
+            if current is not None and plugin_name not in changed and not replaced & set(current.dependencies):
+                continue
+            try:
+                plugin = self.get_plugin(plugin_name, reload=True)
+            except Exception:
+                logger.exception('Could not reload plugin %s', plugin_name)
+                continue
+
+            if current is not None:
+                if current.pending_handle is not None:
+                    current.pending_handle.cancel()
+                # Carry over the state so clients don't see the plugin start from nothing
+                current_state = current.get_state()
+                if current_state is not None:
+                    plugin.set_state(current_state)
+            self.plugins[plugin.id] = plugin
+            reloaded.add(plugin_name)
+
+        self.routes = self.get_routes()
+        self.snapshot_cache = None
+
+        logger.info('Reloaded %s', ', '.join(sorted(reloaded)) or 'nothing')
+        return reloaded
+
+    def add_gauges(self):
+        self.metrics.gauge('hub_requests_depth', self.requests.qsize)
+        self.metrics.gauge('hub_connections', lambda: len(self.connections))
+        self.metrics.gauge('hub_frames_dropped', lambda: self.connections.dropped)
+        self.metrics.gauge('hub_frames_coalesced', lambda: self.connections.coalesced)
+        self.metrics.gauge('hub_box_cache_size', lambda: len(self.boxes))
+        self.metrics.gauge('hub_verification_hit_rate', lambda: self.verifications.hit_rate)
+        self.metrics.gauge('hub_incoming_depth', lambda: sum(len(inbox) for inbox in self.inboxes.values()))
+        self.metrics.gauge('hub_incoming_dropped', lambda: self.incoming_dropped)
+
     def add_tasks(self, loop):
 
         if 'local_auth' in self.config:
@@ -58,11 +263,29 @@ class Hub:
             loop.create_task(self.get_local_stream())
 
         for source in self.sources.values():
-            loop.create_task(source.get_task(self))
-            loop.create_task(self.handle_connect(source))
+            self.start_source(source)
+
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        except (AttributeError, NotImplementedError):
+            pass  # No SIGHUP on this platform, there is still the reload request
 
         loop.create_task(self.get_upstream())
         loop.create_task(self.get_requests())
+        loop.create_task(self.scheduler.get_task())
+
+        if self.store is not None:
+            loop.create_task(self.store.get_task())
+
+        if self.state is not None:
+            loop.create_task(self.state.get_task(self.plugins))
+
+        if 'metrics' in self.config:
+            # Local only by default, this is not meant to be exposed
+            loop.create_task(self.metrics.get_task(
+                self.config['metrics'].get('host', '127.0.0.1'),
+                self.config['metrics'].getint('port', 9100),
+            ))
 
     def get_tls_context(self):
         if 'tls' in self.config:
@@ -86,7 +309,7 @@ class Hub:
         )
 
     # noinspection PyUnusedLocal
-    async def handle_local_auth(self, client, path):
+    async def handle_local_auth(self, client, path=None):
         # 1. Get the public key
         client_public_key = await client.recv()
 
@@ -109,99 +332,341 @@ class Hub:
         )
 
     # noinspection PyUnusedLocal
-    async def handle_local_stream(self, client, path):
+    async def handle_local_stream(self, client, path=None):
         self.connections.add(client)
         try:
             while True:
                 message = await client.recv()
-                await self.requests.put([client, flynn.loads(message)])
+                with self.metrics.time('hub_cbor_seconds', operation='decode'):
+                    message = flynn.loads(message)
+                await self.requests.put([client, message])
         except ConnectionClosed:
             pass
         finally:
-            self.connections.remove(client)
+            self.close_connection(client)
+
+    def close_connection(self, client):
+        channel = self.connections.remove(client)
+        if channel is not None:
+            self.forget_keys(channel)
+
+    def forget_keys(self, channel):
+        for key in channel.keys:
+            self.boxes.discard(key)
+        for verification in channel.verified:
+            self.verifications.discard(verification)
+        channel.keys.clear()
+        channel.verified.clear()
+
+    def check_signature(self, verification):
+        with self.metrics.time('hub_crypto_seconds', operation='verify'):
+            return self.verifications.check(verification)
+
+    async def verify_request(self, client, message):
+        verification = message['verification'] + message['key']
+
+        channel = self.connections.get(client)
+        if channel is not None and channel.verified and verification not in channel.verified:
+            # The client rotated its key, forget about the old one
+            self.forget_keys(channel)
+
+        if not self.verifications.lookup(verification):
+            if not await self.crypto.run(self.check_signature, verification):
+                return False
+            self.verifications.add(verification)
+
+        if channel is not None:
+            channel.keys.add(message['key'])
+            channel.verified.add(verification)
+        return True
 
     async def get_requests(self):
         while True:
             client, message = await self.requests.get()
-            await self.handle_request(client, message)
+            self.scheduler.submit(client, message)
 
-    async def handle_incoming(self, source, message):
+    def get_routes(self):
+        routes = dict()
         for plugin in self.plugins.values():
-            await plugin.on_source_message(source, message)
+            names = (None,) if plugin.message_names is None else plugin.message_names
+            for name in names:
+                routes.setdefault(name, []).append(plugin)
+        return routes
+
+    def get_address_routes(self):
+        routes = dict()
+        for source in self.sources.values():
+            for address in source.addresses:
+                if address in routes:
+                    raise ValueError("Address {} is claimed by both '{}' and '{}'".format(
+                        address, routes[address].id, source.id,
+                    ))
+                routes[address] = source
+        return routes
+
+    def get_source(self, address, default=None):
+        return self.address_routes.get(address, default)
+
+    def get_handlers(self, source, name):
+        for plugins in (self.routes.get(name, ()), self.routes.get(None, ())):
+            for plugin in plugins:
+                if plugin.message_sources is None or source.id in plugin.message_sources:
+                    yield plugin
+
+    async def handle_incoming(self, source, message):
+        # Plugins handle messages on their own and in order, so a slow or failing plugin doesn't hold up the source
+        # or the other plugins. One that can't keep up loses its oldest messages.
+        for plugin in self.get_handlers(source, message.get('name')):
+            inbox = self.inboxes.get(plugin)
+            if inbox is None:
+                inbox = self.inboxes[plugin] = deque()
+                handler = asyncio.ensure_future(self.handle_inbox(plugin, inbox))
+                self.handlers.add(handler)
+                handler.add_done_callback(self.handlers.discard)
+
+            if len(inbox) >= self.inbox_size:
+                inbox.popleft()
+                self.incoming_dropped += 1
+            inbox.append((source, message))
+
+    async def handle_inbox(self, plugin, inbox):
+        try:
+            while inbox:
+                source, message = inbox.popleft()
+                await self.handle_source_message(plugin, source, message)
+        finally:
+            del self.inboxes[plugin]
+
+    async def handle_source_message(self, plugin, source, message):
+        try:
+            with self.metrics.time('hub_plugin_hook_seconds', plugin=plugin.id, hook='on_source_message'):
+                await plugin.on_source_message(source, message)
+        except Exception:
+            logger.exception('Plugin %s failed to handle %s', plugin.id, message.get('name'))
 
     async def handle_connect(self, source):
-        for plugin in self.plugins.values():
+        # Sources call this every time they (re)connect
+        await asyncio.gather(*[self.handle_source_connect(plugin, source) for plugin in self.plugins.values()])
+
+    async def handle_source_connect(self, plugin, source):
+        try:
             await plugin.on_source_connect(source)
+        except Exception:
+            logger.exception('Plugin %s failed to handle connect of %s', plugin.id, source.id)
+
+    def encrypt(self, box, payload, nonce):
+        with self.metrics.time('hub_cbor_seconds', operation='encode'):
+            data = cbor.dumps(payload)
+        with self.metrics.time('hub_crypto_seconds', operation='encrypt'):
+            encrypted = box.encrypt(data, nonce)
+        # Skip the nonce without copying the cipher text
+        return memoryview(encrypted)[len(nonce):]
+
+    def decrypt(self, box, cipher_text, nonce):
+        with self.metrics.time('hub_crypto_seconds', operation='decrypt'):
+            data = box.decrypt(cipher_text, nonce)
+        with self.metrics.time('hub_cbor_seconds', operation='decode'):
+            return flynn.loads(data)
+
+    def seal(self, box, payload, nonce, **fields):
+        # Everything needed to turn a payload into a frame, in one call so it can run on the crypto pool
+        items = list(fields.items())
+        items.append(('nonce', nonce))
+        items.append(('payload', self.encrypt(box, payload, nonce)))
+        with self.metrics.time('hub_cbor_seconds', operation='encode'):
+            return cbor.dumps_map(items)
+
+    async def seal_reply(self, target_public_key, payload):
+        box = self.boxes.get(target_public_key)
+        nonce = nacl.utils.random(Box.NONCE_SIZE)
+        return await self.crypto.run(self.seal, box, payload, nonce, key=target_public_key.encode())
 
     async def reply(self, client, target_public_key, payload):
-        box = Box(self.config['keys']['server_private_key'], target_public_key)
-        nonce = nacl.utils.random(Box.NONCE_SIZE)
-        message = {
-            'key': target_public_key.encode(),
-            'nonce': nonce,
-            'payload':
-                box.encrypt(flynn.dumps(payload), nonce).ciphertext,
-        }
-        await client.send(flynn.dumps(message))
-
-    async def broadcast(self, payload):
-        box = SecretBox(bytes(self.config['keys']['server_public_key']))
-        nonce = nacl.utils.random(Box.NONCE_SIZE)
-        message = {
-            'nonce': nonce,
-            'payload':
-                box.encrypt(flynn.dumps(payload), nonce).ciphertext,
-        }
-        cbor_message = flynn.dumps(message)
-        for client in self.connections:
-            try:
-                await client.send(cbor_message)
-            except ConnectionClosed:
-                self.connections.remove(client)
+        # A client that is gone by the time the reply is ready simply doesn't get it
+        cbor_message = await self.seal_reply(target_public_key, payload)
+        if not self.connections.send(client, cbor_message):
+            logger.debug('Dropped a reply to a closed connection')
+
+    async def broadcast(self, payload, label=None, coalesce=True):
+        # Encrypted once per subscription set, clients without a subscription get everything
+        for labels, channels in self.connections.get_groups(label):
+            nonce = nacl.utils.random(Box.NONCE_SIZE)
+            if labels is None:
+                cbor_message = await self.crypto.run(self.seal, self.broadcast_box, payload, nonce)
+            else:
+                group = self.group_keys.get(labels)
+                cbor_message = await self.crypto.run(self.seal, group.box, payload, nonce, group=group.id)
+
+            with self.metrics.time('hub_broadcast_seconds'):
+                self.connections.broadcast(cbor_message, label, coalesce=coalesce, channels=channels)
+
+    def has_subscribers(self, label):
+        return self.connections.has_subscribers(label)
+
+    def needs_keyframe(self, label):
+        return self.connections.take_gap(label)
+
+    def get_snapshot(self, known=None, labels=None):
+        # One frame with the state of every plugin, leaving out what the client already has
+        versions = dict()
+        if known and known.get('epoch') == self.epoch:
+            versions = known.get('versions') or {}
+
+        current = [plugin.snapshot for plugin in self.plugins.values() if plugin.snapshot is not None]
+        snapshots = [
+            snapshot for snapshot in current
+            if versions.get(snapshot.label) != snapshot.version and (labels is None or snapshot.label in labels)
+        ]
+
+        # Reconnecting clients mostly ask for the same thing, so keep the last one around
+        key = (
+            tuple((snapshot.label, snapshot.version) for snapshot in current),
+            tuple(snapshot.label for snapshot in snapshots),
+        )
+        if self.snapshot_cache is not None and self.snapshot_cache[0] == key:
+            return self.snapshot_cache[1]
+
+        payload = cbor.Encoded(cbor.dumps_map([
+            ('label', 'snapshot'),
+            ('data', cbor.Encoded(cbor.dumps_map([
+                ('epoch', self.epoch),
+                ('versions', dict((snapshot.label, snapshot.version) for snapshot in current)),
+                ('labels', cbor.Encoded(cbor.dumps_map([
+                    (snapshot.label, snapshot.encoded) for snapshot in snapshots
+                ]))),
+            ]))),
+        ]))
+        self.snapshot_cache = (key, payload)
+        return payload
 
     async def handle_request(self, client, message):
         client_public_key = PublicKey(message['key'])
 
         # Check if it is signed
-        verification = message['verification'] + message['key']
-        try:
-            self.config['keys']['facade_signing_key'].verify_key.verify(verification)
-        except BadSignatureError:
+        if not await self.verify_request(client, message):
             await self.reply(client, client_public_key, {'error': 'Who are you?'})
         else:
             nonce = message['nonce']
             cipher_text = message['payload']
             try:
-                box = Box(self.config['keys']['server_private_key'], client_public_key)
-                request = flynn.loads(box.decrypt(cipher_text, nonce))
-                if request == 'hello':  # Pong
-                    await self.reply(client, client_public_key, request)
+                box = self.boxes.get(client_public_key)
+                request = await self.crypto.run(self.decrypt, box, cipher_text, nonce)
+
+                if request == 'hello' or isinstance(request, dict) and 'hello' in request:  # Pong
+                    await self.reply(client, client_public_key, 'hello')
+                    known = request['hello'] if isinstance(request, dict) else None
+                    channel = self.connections.get(client)
+                    labels = channel.labels if channel is not None else None
+                    await self.reply(client, client_public_key, self.get_snapshot(known, labels))
+
                     for plugin in self.plugins.values():
-                        await plugin.on_client_connect(client, client_public_key)
+                        with self.metrics.time('hub_plugin_hook_seconds', plugin=plugin.id, hook='on_client_connect'):
+                            await plugin.on_client_connect(client, client_public_key)
+                elif isinstance(request, dict) and request.get('target') == 'hub':
+                    await self.handle_hub_request(client, client_public_key, request)
                 else:
                     for plugin in self.plugins.values():
-                        await plugin.on_client_request(client, client_public_key, request)
+                        with self.metrics.time('hub_plugin_hook_seconds', plugin=plugin.id, hook='on_client_request'):
+                            await plugin.on_client_request(client, client_public_key, request)
 
             except CryptoError:
                 pass  # TODO: what to do, what to do.
             except InvalidCborError:
                 pass  # TODO: what to do, what to do.
 
+    async def handle_hub_request(self, client, client_public_key, request):
+        if request.get('command') == 'subscribe':
+            labels = request.get('labels')
+            if labels is not None and not (
+                    isinstance(labels, list) and all(isinstance(label, str) for label in labels)):
+                await self.reply(client, client_public_key, {
+                    'label': 'hub',
+                    'error': 'labels should be a list of strings',
+                })
+                return
+
+            await self.subscribe(client, client_public_key, frozenset(labels) if labels is not None else None)
+
+        elif request.get('command') == 'reload':
+            if not self.is_admin(client_public_key):
+                await self.reply(client, client_public_key, {'label': 'hub', 'error': 'Not allowed'})
+                return
+
+            reloaded = self.reload()
+            await self.reply(client, client_public_key, {
+                'label': 'hub',
+                'data': {'reloaded': sorted(reloaded) if reloaded is not None else None},
+            })
+
+    def is_admin(self, client_public_key):
+        # Changing what the hub runs is up to the keys in [keys] admin_public_keys, not to every facade
+        admin_keys = self.config['keys'].get('admin_public_keys', '').split()
+        return client_public_key.encode(Base64Encoder).decode('utf-8') in admin_keys
+
+    def get_versions(self, labels):
+        return tuple((plugin.label, plugin.version) for plugin in self.plugins.values() if plugin.label in labels)
+
+    async def subscribe(self, client, client_public_key, labels):
+        channel = self.connections.get(client)
+        if channel is None:
+            return
+
+        # Labels the client didn't get so far need their current state before any delta can be applied
+        if channel.labels is None:
+            added = set()
+        else:
+            added = (labels if labels is not None else set(plugin.label for plugin in self.plugins.values())) - \
+                    channel.labels
+
+        data = {'labels': sorted(labels) if labels is not None else None}
+        if labels is not None:
+            group = self.group_keys.get(labels)
+            data.update(group=group.id, key=group.key)
+        frames = [await self.seal_reply(client_public_key, {'label': 'hub', 'data': data})]
+
+        if added:
+            # A plugin publishing while we seal would make the snapshot stale, seal it again then
+            while True:
+                versions = self.get_versions(added)
+                snapshot = await self.seal_reply(client_public_key, self.get_snapshot(labels=added))
+                if versions == self.get_versions(added):
+                    break
+            frames.append(snapshot)
+
+        # No awaits from here on, so no broadcast can get in between the snapshot and the subscription
+        self.connections.subscribe(client, labels)
+        for frame in frames:
+            self.connections.send(client, frame)
+        for plugin in self.plugins.values():
+            if plugin.label in added:
+                plugin.resync()
+
     async def get_upstream(self):
+        # One channel for the lifetime of the hub, so broadcasts are kept while we are disconnected
+        channel = upstream.from_config(self.connections, self.config['upstream']) \
+            if self.config.has_section('upstream') else upstream.UpstreamChannel(self.connections)
+        self.connections.add(channel, channel)
+        if channel.spool is not None:
+            self.metrics.gauge('hub_upstream_spool_bytes', lambda: len(channel.spool))
+        compression = 'deflate' if self.config.getboolean('upstream', 'compression', fallback=True) else None
+
         wait_time = 1
         while True:
             try:
-                async with websockets.connect(self.config['hub']['upstream']) as upstream:
+                async with websockets.connect(self.config['hub']['upstream'], compression=compression) as websocket:
                     wait_time = 1
-                    self.connections.add(upstream)
                     try:
+                        await channel.attach(websocket)
                         while True:
-                            message = await upstream.recv()
-                            await self.requests.put([upstream, flynn.loads(message)])
+                            message = await websocket.recv()
+                            with self.metrics.time('hub_cbor_seconds', operation='decode'):
+                                message = flynn.loads(message)
+                            await self.requests.put([channel, message])
                     except ConnectionClosed:
                         pass
                     finally:
-                        self.connections.remove(upstream)
+                        channel.detach()
+                        self.forget_keys(channel)
             except (ConnectionRefusedError, OSError, InvalidHandshake):
                 # We will wait a while before reconnecting
                 await asyncio.sleep(wait_time)
@@ -2,14 +2,13 @@ import argparse
 import asyncio
 import logging
 import sys
-from configparser import ConfigParser
 
 from nacl.encoding import Base64Encoder
 from nacl.public import PrivateKey
 from nacl.signing import SigningKey
 
 from . import Hub
-from .config import KeyInterpolation
+from .config import load_config
 
 parser = argparse.ArgumentParser(
     description='Central hub for hemma'
@@ -85,11 +84,7 @@ else:
 
     loop.set_debug(args.debug)
 
-    config = ConfigParser(interpolation=KeyInterpolation())
-    with open(args.config, 'r') as f:
-        config.read_file(f)
-
-    hub = Hub(config)
+    hub = Hub(load_config(args.config))
 
     try:
         hub.add_tasks(loop)
@@ -0,0 +1,55 @@
+import struct
+
+import flynn
+
+MAJOR_BYTES = 2
+MAJOR_MAP = 5
+
+
+class Encoded:
+    # CBOR that is already encoded, embedded as is when framing
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+def header(major, length):
+    major <<= 5
+    if length < 24:
+        return bytes((major | length,))
+    elif length < 0x100:
+        return struct.pack('>BB', major | 24, length)
+    elif length < 0x10000:
+        return struct.pack('>BH', major | 25, length)
+    elif length < 0x100000000:
+        return struct.pack('>BI', major | 26, length)
+    return struct.pack('>BQ', major | 27, length)
+
+
+def add_value(parts, value):
+    if isinstance(value, Encoded):
+        parts.append(value.data)
+    elif isinstance(value, memoryview):
+        # Byte strings passed as a memoryview end up in the frame without being copied first
+        parts.append(header(MAJOR_BYTES, value.nbytes))
+        parts.append(value)
+    else:
+        parts.append(flynn.dumps(value))
+
+
+def dumps_map(items):
+    parts = [header(MAJOR_MAP, len(items))]
+    for key, value in items:
+        parts.append(flynn.dumps(key))
+        add_value(parts, value)
+    return b''.join(parts)
+
+
+def dumps(value):
+    if isinstance(value, Encoded):
+        return value.data
+    return flynn.dumps(value)
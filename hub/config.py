@@ -1,9 +1,11 @@
-from configparser import ExtendedInterpolation
+from configparser import ConfigParser, ExtendedInterpolation
 
 from nacl.encoding import Base64Encoder
 from nacl.public import PublicKey, PrivateKey
 from nacl.signing import SigningKey, VerifyKey
 
+REQUIRED_KEYS = ('server_private_key', 'server_public_key', 'facade_signing_key')
+
 
 class KeyInterpolation(ExtendedInterpolation):
     def before_get(self, parser, section, option, value, defaults):
@@ -19,3 +21,105 @@ class KeyInterpolation(ExtendedInterpolation):
             return VerifyKey(value.encode('utf-8'), encoder=Base64Encoder)
 
         return value
+
+
+class Section:
+    # The resolved options of one section, read like a SectionProxy without interpolating on every get
+
+    def __init__(self, name, values, raw):
+        self.name = name
+        self.values = values
+        self.raw = raw
+
+    def __contains__(self, option):
+        return option in self.values
+
+    def __getitem__(self, option):
+        return self.values[option]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __eq__(self, other):
+        return isinstance(other, Section) and self.raw == other.raw
+
+    def get(self, option, fallback=None):
+        return self.values.get(option, fallback)
+
+    def _get_converted(self, option, conversion, fallback):
+        if option not in self.values:
+            return fallback
+        try:
+            return conversion(self.values[option])
+        except ValueError:
+            raise ValueError("Invalid value for '{}' in [{}]: {!r}".format(option, self.name, self.values[option]))
+
+    def getint(self, option, fallback=None):
+        return self._get_converted(option, int, fallback)
+
+    def getfloat(self, option, fallback=None):
+        return self._get_converted(option, float, fallback)
+
+    def getboolean(self, option, fallback=None):
+        def to_boolean(value):
+            if value.lower() not in ConfigParser.BOOLEAN_STATES:
+                raise ValueError(value)
+            return ConfigParser.BOOLEAN_STATES[value.lower()]
+        return self._get_converted(option, to_boolean, fallback)
+
+
+class RuntimeConfig:
+    # Every section resolved once, keys included; only an explicit reload reads the parser again
+
+    def __init__(self, parser, path=None):
+        self.path = path
+        self.sections = {}
+        self.load(parser)
+
+    def load(self, parser):
+        sections = {}
+        for name in parser.sections():
+            try:
+                values = dict((option, parser.get(name, option)) for option in parser.options(name))
+            except (ValueError, TypeError) as e:
+                raise ValueError("Invalid value in [{}]: {}".format(name, e))
+            raw = dict((option, parser.get(name, option, raw=True)) for option in parser.options(name))
+            sections[name] = Section(name, values, raw)
+
+        missing = [key for key in REQUIRED_KEYS if key not in sections.get('keys', ())]
+        if missing:
+            raise ValueError("Missing in [keys]: {}".format(', '.join(missing)))
+
+        # Returns the sections that were added, removed or changed
+        changed = set(name for name in set(sections) | set(self.sections)
+                      if sections.get(name) != self.sections.get(name))
+        self.sections = sections
+        return changed
+
+    def reload(self):
+        return self.load(read_parser(self.path))
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def __getitem__(self, name):
+        return self.sections[name]
+
+    def has_section(self, name):
+        return name in self.sections
+
+    def getboolean(self, name, option, fallback=None):
+        if name not in self.sections:
+            return fallback
+        return self.sections[name].getboolean(option, fallback)
+
+
+def read_parser(path):
+    parser = ConfigParser(interpolation=KeyInterpolation())
+    with open(path, 'r') as f:
+        parser.read_file(f)
+    return parser
+
+
+def load_config(path):
+    return RuntimeConfig(read_parser(path), path=path)
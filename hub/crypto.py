@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from nacl.exceptions import BadSignatureError
+from nacl.public import Box, PublicKey
+from nacl.secret import SecretBox
+
+
+class BoxCache:
+    # Box does the Curve25519 key agreement on construction, so keep the precomputed boxes around per client key
+
+    def __init__(self, private_key, maxsize=128):
+        self.private_key = private_key
+        self.maxsize = maxsize
+        self.boxes = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def get(self, public_key):
+        key = bytes(public_key)
+        box = self.boxes.get(key)
+        if box is not None:
+            self.hits += 1
+            self.boxes.move_to_end(key)
+            return box
+
+        self.misses += 1
+        if not isinstance(public_key, PublicKey):
+            public_key = PublicKey(key)
+
+        box = self.boxes[key] = Box(self.private_key, public_key)
+        if len(self.boxes) > self.maxsize:
+            self.boxes.popitem(last=False)
+        return box
+
+    def discard(self, public_key):
+        self.boxes.pop(bytes(public_key), None)
+
+
+class GroupKey:
+    __slots__ = ('labels', 'key', 'id', 'box')
+
+    def __init__(self, labels, key):
+        self.labels = labels
+        self.key = key
+        self.id = hashlib.blake2b(key, digest_size=8).digest()
+        self.box = SecretBox(key)
+
+
+class GroupKeys:
+    # A broadcast key per subscription set, derived from the server key so it is the same across restarts
+
+    def __init__(self, private_key):
+        self.secret = bytes(private_key)
+        self.groups = {}
+
+    def get(self, labels):
+        group = self.groups.get(labels)
+        if group is None:
+            name = '\n'.join(sorted(labels)).encode('utf-8')
+            key = hashlib.blake2b(name, key=self.secret, person=b'hemma-group', digest_size=SecretBox.KEY_SIZE)
+            group = self.groups[labels] = GroupKey(labels, key.digest())
+        return group
+
+
+class VerificationCache:
+    # Clients send the same signed key with every request, so only check a signature once per TTL
+
+    def __init__(self, verify_key, ttl=300, maxsize=1024):
+        self.verify_key = verify_key
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.verified = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.verified)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def lookup(self, signed):
+        expires = self.verified.get(signed)
+        if expires is not None and expires > time.monotonic():
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def check(self, signed):
+        # Doesn't touch the cache, so this is safe to run on the crypto pool
+        try:
+            self.verify_key.verify(signed)
+        except BadSignatureError:
+            return False
+        return True
+
+    def add(self, signed):
+        self.verified[signed] = time.monotonic() + self.ttl
+        self.verified.move_to_end(signed)
+        if len(self.verified) > self.maxsize:
+            self.verified.popitem(last=False)
+
+    def verify(self, signed):
+        if self.lookup(signed):
+            return True
+
+        if not self.check(signed):
+            self.discard(signed)
+            return False
+
+        self.add(signed)
+        return True
+
+    def discard(self, signed):
+        self.verified.pop(signed, None)
+
+
+def run_batch(calls):
+    results = []
+    for function, args, kwargs in calls:
+        try:
+            results.append((True, function(*args, **kwargs)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+class CryptoExecutor:
+    # libsodium releases the GIL, so with many clients crypto and CBOR work can move to a thread pool.
+    # Calls are batched per loop iteration and their results are handed out in submission order.
+
+    def __init__(self, workers=0, batch_size=32):
+        self.pool = ThreadPoolExecutor(workers) if workers else None
+        self.batch_size = batch_size
+        self.batch = []
+        self.scheduled = False
+        self.last = None
+
+    async def run(self, function, *args, **kwargs):
+        if self.pool is None:
+            return function(*args, **kwargs)
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.batch.append((function, args, kwargs, future))
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            loop.call_soon(self.flush)
+
+        return await future
+
+    def flush(self):
+        self.scheduled = False
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+
+        loop = asyncio.get_event_loop()
+        results = loop.run_in_executor(self.pool, run_batch, [call[:3] for call in batch])
+        self.last = asyncio.ensure_future(self.complete(self.last, results, [call[3] for call in batch]))
+
+    @staticmethod
+    async def complete(previous, results, futures):
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        for future, (ok, result) in zip(futures, await results):
+            if future.cancelled():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
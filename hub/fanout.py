@@ -0,0 +1,170 @@
+import asyncio
+from collections import deque
+
+from websockets.exceptions import ConnectionClosed
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+
+POLICIES = (DROP_OLDEST, COALESCE)
+
+
+class Channel:
+    def __init__(self, client, fanout):
+        self.client = client
+        self.fanout = fanout
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.task = None
+        self.keys = set()
+        self.verified = set()
+
+        # The labels this client subscribed to, None is all of them
+        self.labels = None
+        # Inactive channels don't count as subscribers and get no broadcasts
+        self.active = True
+
+        self.dropped = 0
+        self.coalesced = 0
+
+    def put(self, frame, label=None, policy=DROP_OLDEST):
+        # Frames without a label are replies; those are never dropped or coalesced
+        if label is not None:
+            if policy == COALESCE:
+                self._coalesce(label)
+            if len(self.frames) >= self.fanout.maxsize:
+                self._drop_oldest()
+
+        self.frames.append((label, frame))
+        self.ready.set()
+
+    def _coalesce(self, label):
+        # The new frame supersedes everything still pending for its label
+        if not any(pending_label == label for pending_label, _ in self.frames):
+            return
+
+        pending = len(self.frames)
+        self.frames = deque(item for item in self.frames if item[0] != label)
+        self.coalesced += pending - len(self.frames)
+        self.fanout.coalesced += pending - len(self.frames)
+
+    def _drop_oldest(self):
+        for index, (pending_label, _) in enumerate(self.frames):
+            if pending_label is not None:
+                del self.frames[index]
+                self.dropped += 1
+                self.fanout.dropped += 1
+                self.fanout.gaps.add(pending_label)
+                return
+
+    async def run(self):
+        try:
+            while True:
+                while not self.frames:
+                    self.ready.clear()
+                    await self.ready.wait()
+
+                _, frame = self.frames.popleft()
+                await self.client.send(frame)
+        except ConnectionClosed:
+            pass
+
+
+class FanOut:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.policies = {}
+        self.channels = {}
+        # Channels by the set of labels they subscribed to, so each set is encrypted only once
+        self.subscriptions = {}
+
+        self.dropped = 0
+        self.coalesced = 0
+        # Labels of which a frame was dropped since the last keyframe
+        self.gaps = set()
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, client):
+        return client in self.channels
+
+    def set_policy(self, label, policy):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy '{}' for '{}'".format(policy, label))
+        self.policies[label] = policy
+
+    def add(self, client, channel=None):
+        if channel is None:
+            channel = Channel(client, self)
+        channel.task = asyncio.ensure_future(channel.run())
+        self.channels[client] = channel
+        self._subscribe(channel)
+        return channel
+
+    def get(self, client):
+        return self.channels.get(client)
+
+    def remove(self, client):
+        channel = self.channels.pop(client, None)
+        if channel is not None:
+            channel.task.cancel()
+            self._unsubscribe(channel)
+        return channel
+
+    def _subscribe(self, channel):
+        if channel.active:
+            self.subscriptions.setdefault(channel.labels, set()).add(channel)
+
+    def _unsubscribe(self, channel):
+        channels = self.subscriptions.get(channel.labels)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.subscriptions[channel.labels]
+
+    def subscribe(self, client, labels):
+        channel = self.channels.get(client)
+        if channel is None:
+            return None
+
+        self._unsubscribe(channel)
+        channel.labels = frozenset(labels) if labels is not None else None
+        self._subscribe(channel)
+        return channel
+
+    def set_active(self, channel, active):
+        self._unsubscribe(channel)
+        channel.active = active
+        self._subscribe(channel)
+
+    def get_groups(self, label):
+        # Copies, a channel subscribing while a frame is being sealed shouldn't get it
+        return [
+            (labels, list(channels)) for labels, channels in self.subscriptions.items()
+            if labels is None or label in labels
+        ]
+
+    def has_subscribers(self, label):
+        return any(labels is None or label in labels for labels in self.subscriptions)
+
+    def take_gap(self, label):
+        if label not in self.gaps:
+            return False
+        self.gaps.discard(label)
+        return True
+
+    def send(self, client, frame):
+        channel = self.channels.get(client)
+        if channel is None:
+            return False
+
+        channel.put(frame)
+        return True
+
+    def broadcast(self, frame, label=None, coalesce=True, channels=None):
+        policy = self.policies.get(label, DROP_OLDEST) if coalesce else DROP_OLDEST
+        if channels is None:
+            channels = self.channels.values()
+        for channel in list(channels):
+            channel.put(frame, label, policy)
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from intelhex import IntelHex
+
+
+class Image:
+    def __init__(self, data):
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+
+    def __len__(self):
+        return len(self.data)
+
+    def block(self, address, size):
+        # Past the end of an image the flash reads as erased
+        data = self.data[address:address + size]
+        return data + b'\xff' * (size - len(data))
+
+
+def parse(hex_data):
+    hex_file = IntelHex(StringIO(hex_data.decode('utf-8')))
+    return Image(hex_file.tobinstr(start=0, size=len(hex_file)))
+
+
+class FirmwareCache:
+    # Parsed images by content hash, and the image last flashed to each address
+
+    def __init__(self, path=None):
+        self.path = path
+        self.images = {}
+        self.parsed = {}
+        self.flashed = {}
+        # Cache files are read and written one at a time, off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            if os.path.exists(self.flashed_path):
+                with open(self.flashed_path, 'r') as f:
+                    self.flashed = json.load(f)
+
+    @property
+    def flashed_path(self):
+        return os.path.join(self.path, 'flashed.json')
+
+    def image_path(self, digest):
+        return os.path.join(self.path, '{}.bin'.format(digest))
+
+    async def run(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def load(self, hex_data):
+        source_digest = hashlib.sha256(hex_data).hexdigest()
+        image = await self.get(self.parsed.get(source_digest))
+        if image is not None:
+            return image
+
+        # Parsing a hex file is slow, keep it off the event loop
+        image = await asyncio.get_event_loop().run_in_executor(None, parse, hex_data)
+        self.parsed[source_digest] = image.digest
+        await self.add(image)
+        return image
+
+    async def add(self, image):
+        self.images[image.digest] = image
+        if self.path is not None:
+            await self.run(self.write_image, image)
+
+    def write_image(self, image):
+        if not os.path.exists(self.image_path(image.digest)):
+            with open(self.image_path(image.digest), 'wb') as f:
+                f.write(image.data)
+
+    async def get(self, digest):
+        if digest is None:
+            return None
+
+        image = self.images.get(digest)
+        if image is None and self.path is not None:
+            image = await self.run(self.read_image, digest)
+            if image is not None:
+                self.images[digest] = image
+        return image
+
+    def read_image(self, digest):
+        if not os.path.exists(self.image_path(digest)):
+            return None
+        with open(self.image_path(digest), 'rb') as f:
+            return Image(f.read())
+
+    async def last_flashed(self, address):
+        return await self.get(self.flashed.get(str(address)))
+
+    async def set_flashed(self, address, image):
+        self.flashed[str(address)] = image.digest
+
+        if self.path is not None:
+            await self.run(self.write_flashed, dict(self.flashed))
+
+    def write_flashed(self, flashed):
+        temp_path = self.flashed_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(flashed, f)
+        os.replace(temp_path, self.flashed_path)
@@ -0,0 +1,146 @@
+import asyncio
+import bisect
+import threading
+import time
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in items) + '}'
+
+
+class Histogram:
+    # Observed from the crypto workers as well as the event loop
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield '{}_bucket{} {}'.format(name, format_labels(labels, le=bound), cumulative)
+        yield '{}_bucket{} {}'.format(name, format_labels(labels, le='+Inf'), count)
+        yield '{}_sum{} {}'.format(name, format_labels(labels), total)
+        yield '{}_count{} {}'.format(name, format_labels(labels), count)
+
+
+class Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    # Histograms are only kept when enabled, gauges are sampled when rendered so they cost nothing in between
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.histograms_lock = threading.Lock()
+        self.gauges = {}
+
+    def get_histogram(self, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.histograms_lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def time(self, name, **labels):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self.get_histogram(name, labels))
+
+    def observe(self, name, value, **labels):
+        if self.enabled:
+            self.get_histogram(name, labels).observe(value)
+
+    def gauge(self, name, callback, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = callback
+
+    def remove_gauge(self, name, **labels):
+        self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def render(self):
+        lines = []
+
+        # Workers may add histograms while this runs
+        with self.histograms_lock:
+            histograms = sorted(self.histograms.items(), key=lambda i: i[0])
+
+        for name in sorted(set(name for (name, _), _ in histograms)):
+            lines.append('# TYPE {} histogram'.format(name))
+            for (histogram_name, labels), histogram in histograms:
+                if histogram_name == name:
+                    lines.extend(histogram.render(name, labels))
+
+        for name in sorted(set(name for name, _ in self.gauges)):
+            lines.append('# TYPE {} gauge'.format(name))
+            for (gauge_name, labels), callback in sorted(self.gauges.items(), key=lambda i: i[0]):
+                if gauge_name == name:
+                    lines.append('{}{} {}'.format(name, format_labels(labels), callback()))
+
+        return '\n'.join(lines) + '\n'
+
+    async def handle_http(self, reader, writer):
+        try:
+            # Whatever is asked for, we only serve the exposition
+            while (await reader.readline()).strip():
+                pass
+
+            body = self.render().encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\n')
+            writer.write(b'Content-Type: text/plain; version=0.0.4\r\n')
+            writer.write('Content-Length: {}\r\n\r\n'.format(len(body)).encode('utf-8'))
+            writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def get_task(self, host, port):
+        await asyncio.start_server(self.handle_http, host, port)
+
+
+def from_config(config):
+    return Metrics(enabled=config.getboolean('enabled', True))
@@ -1,22 +1,205 @@
+import asyncio
+import logging
+
+import flynn
+
+from ..cbor import Encoded, dumps_map
+from ..fanout import DROP_OLDEST
+
+logger = logging.getLogger(__name__)
+
+
+def get_ids(items):
+    # Lists of records with an id are updated per record: a record in a delta replaces the one with its id
+    if all(isinstance(item, dict) and 'id' in item for item in items):
+        return [item['id'] for item in items]
+    return None
+
+
+def get_delta(previous, content):
+    if isinstance(content, dict) and isinstance(previous, dict):
+        return dict((k, v) for k, v in content.items() if k not in previous or previous[k] != v)
+    elif isinstance(content, list) and isinstance(previous, list):
+        return [item for item in content if item not in previous]
+    return content
+
+
+def get_removed(previous, content):
+    # What a delta has to tell clients to forget: the keys gone from a dict, or the ids gone from a list of
+    # records. None if a delta can't express it, other list deltas only ever add items.
+    if isinstance(content, dict) and isinstance(previous, dict):
+        return [k for k in previous if k not in content]
+    elif isinstance(content, list) and isinstance(previous, list):
+        previous_ids, ids = get_ids(previous), get_ids(content)
+        if previous_ids is not None and ids is not None:
+            return [i for i in previous_ids if i not in ids]
+        return [] if all(item in content for item in previous) else None
+    return []
+
+
+class Snapshot:
+    # An immutable version of a plugin's state, encoded once no matter how many clients get it
+    __slots__ = ('label', 'version', 'content', '_encoded', '_payload')
+
+    def __init__(self, label, version, content):
+        self.label = label
+        self.version = version
+        self.content = content
+        self._encoded = None
+        self._payload = None
+
+    @property
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = Encoded(flynn.dumps(self.content))
+        return self._encoded
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = Encoded(dumps_map([('label', self.label), ('data', self.encoded)]))
+        return self._payload
+
+
 class Plugin:
     label = None
     id = None
+    overflow = DROP_OLDEST
+
+    # Broadcast only what changed since the last frame, with a full frame every keyframe_interval frames
+    delta = False
+    keyframe_interval = 30
+
+    # Maximum frames per second, bursts in between are merged into one frame
+    max_rate = None
+
+    # Source message names and source ids to receive, None means all of them
+    message_names = None
+    message_sources = None
+
+    # Ids of the sources this plugin holds on to, it is rebuilt when one of them is replaced
+    dependencies = ()
 
     def __init__(self, plugin_id, hub):
         self.id = plugin_id
         self.hub = hub
 
+        self.snapshot = None
+        self.version = 0
+
+        self.sent = None
+        self.sequence = 0
+        self.last_broadcast = None
+        self.pending = None
+        self.pending_handle = None
+        self.pending_task = None
+
+    def configure(self, config):
+        self.overflow = config.get('overflow', self.overflow)
+        if 'sources' in config:
+            self.message_sources = tuple(config['sources'].split())
+
+        self.delta = config.getboolean('delta', self.delta)
+        self.keyframe_interval = config.getint('keyframe_interval', self.keyframe_interval)
+        self.max_rate = config.getfloat('max_rate', self.max_rate)
+
     async def reply(self, target, target_key, content):
         await self.hub.reply(target, target_key, {
             'label': self.label,
             'data': content,
         })
 
+    def publish(self, content):
+        # Only a change in state makes a new version, and with that a new encoding
+        if self.snapshot is None or self.snapshot.content != content:
+            self.version += 1
+            self.snapshot = Snapshot(self.label, self.version, content)
+        return self.snapshot
+
+    def record(self, readings, timestamp):
+        if self.hub.store is None:
+            return
+
+        for name, value in readings.items():
+            if name != 'timestamp' and isinstance(value, (int, float)):
+                self.hub.store.append(self.label, name, value, timestamp)
+
+    def resync(self):
+        # The next broadcast is a keyframe, for clients that can't apply a delta to what they have
+        self.sent = None
+
+    def get_state(self):
+        # Whatever is needed to pick up where we left off after a restart
+        return self.snapshot.content if self.snapshot is not None else None
+
+    def set_state(self, state):
+        self.publish(state)
+
     async def broadcast(self, content):
-        await self.hub.broadcast({
-            'label': self.label,
-            'data': content,
-        })
+        snapshot = self.publish(content)
+
+        # Nobody to send it to, don't spend any time encoding it. Whoever subscribes later gets the snapshot
+        # and a keyframe after that.
+        if not self.hub.has_subscribers(self.label):
+            self.resync()
+            return
+
+        if self.max_rate and self.last_broadcast is not None:
+            loop = asyncio.get_event_loop()
+            wait = self.last_broadcast + 1 / self.max_rate - loop.time()
+            if wait > 0:
+                self.pending = snapshot
+                if self.pending_handle is None:
+                    self.pending_handle = loop.call_later(wait, self.send_pending)
+                return
+
+        await self.send_broadcast(snapshot)
+
+    def send_pending(self):
+        snapshot, self.pending, self.pending_handle = self.pending, None, None
+        self.pending_task = asyncio.ensure_future(self.send_broadcast(snapshot))
+        self.pending_task.add_done_callback(self.sent_pending)
+
+    def sent_pending(self, task):
+        if self.pending_task is task:
+            self.pending_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Plugin %s failed to broadcast', self.id, exc_info=task.exception())
+
+    async def send_broadcast(self, snapshot):
+        self.last_broadcast = asyncio.get_event_loop().time()
+
+        if not self.delta:
+            await self.hub.broadcast(snapshot.payload, self.label)
+            return
+
+        # A client that lost a frame to a full queue can't apply deltas until it gets a keyframe
+        removed = get_removed(self.sent, snapshot.content) if self.sent is not None else None
+        if self.hub.needs_keyframe(self.label) or removed is None or self.sequence % self.keyframe_interval == 0:
+            payload = Encoded(dumps_map([
+                ('label', self.label),
+                ('sequence', self.sequence),
+                ('data', snapshot.encoded),
+            ]))
+            coalesce = True
+        else:
+            delta = get_delta(self.sent, snapshot.content)
+            if not delta and not removed:
+                return
+            payload = {
+                'label': self.label,
+                'sequence': self.sequence,
+                'delta': delta,
+            }
+            # Keys to delete on the client, a delta on its own can only add or change them
+            if removed:
+                payload['removed'] = removed
+            # Deltas only make sense in sequence, those can't be coalesced
+            coalesce = False
+
+        self.sent = snapshot.content
+        self.sequence += 1
+        await self.hub.broadcast(payload, self.label, coalesce=coalesce)
 
     async def on_source_connect(self, source):
         pass
@@ -25,6 +208,7 @@ class Plugin:
         raise NotImplementedError
 
     async def on_client_connect(self, client, client_key):
+        # The current snapshot is already sent to the client by the hub
         pass
 
     async def on_client_request(self, client, client_key, request):
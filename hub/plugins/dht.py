@@ -5,21 +5,28 @@ from .base import Plugin
 
 class DHTPlugin(Plugin):
     label = "dht"
+    message_names = ('dht',)
 
     state = None
     timestamp = None
 
-    async def on_source_message(self, source, message):
-        if 'name' in message and message['name'] == 'dht':
-            self.state = message["data"]
-            self.timestamp = datetime.now().timestamp()
+    def get_state(self):
+        if not self.state:
+            return None
+        return {'state': self.state, 'timestamp': int(self.timestamp * 1000)}
+
+    def set_state(self, state):
+        self.state = state['state']
+        self.timestamp = state['timestamp'] / 1000
+        self.publish(self.state)
 
-            if self.state:
-                await self.broadcast(self.state)
+    async def on_source_message(self, source, message):
+        self.state = message["data"]
+        self.timestamp = datetime.now().timestamp()
 
-    async def on_client_connect(self, client, client_key):
         if self.state:
-            await self.reply(client, client_key, self.state)
+            self.record(self.state, int(self.timestamp * 1000))
+            await self.broadcast(self.state)
 
     async def on_client_request(self, client, client_key, request):
         pass
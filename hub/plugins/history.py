@@ -0,0 +1,155 @@
+import numpy as np
+
+from .base import Plugin
+
+DEFAULT_RESOLUTIONS = (60000, 300000, 3600000)
+
+
+def summarize(timestamps, values, resolution):
+    timestamps = np.frombuffer(timestamps, dtype=np.int64)
+    values = np.frombuffer(values, dtype=np.float64)
+
+    if not len(timestamps):
+        empty = np.empty(0)
+        return Summary(np.empty(0, dtype=np.int64), empty, empty, empty, empty, np.empty(0, dtype=np.int64))
+
+    buckets = timestamps // resolution
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.append(starts[1:], len(values))
+    counts = ends - starts
+
+    return Summary(
+        buckets[starts] * resolution,
+        np.minimum.reduceat(values, starts),
+        np.maximum.reduceat(values, starts),
+        np.add.reduceat(values, starts) / counts,
+        values[ends - 1],
+        counts,
+    )
+
+
+class Summary:
+    fields = ('timestamp', 'min', 'max', 'mean', 'last', 'count')
+
+    def __init__(self, timestamp, minimum, maximum, mean, last, count):
+        self.timestamp = timestamp
+        self.min = minimum
+        self.max = maximum
+        self.mean = mean
+        self.last = last
+        self.count = count
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def slice(self, start, end):
+        low, high = np.searchsorted(self.timestamp, (start, end))
+        return Summary(*(getattr(self, field)[low:high] for field in self.fields))
+
+    def extend(self, other):
+        return Summary(*(np.concatenate((getattr(self, field), getattr(other, field))) for field in self.fields))
+
+    def as_dict(self):
+        return dict((field, getattr(self, field).tolist()) for field in self.fields)
+
+
+class CachedSummary:
+    # Buckets before the one holding the newest sample can't change anymore, so those are kept. The cache starts
+    # at the earliest bucket asked for, not at the start of the series, and grows from there in both directions.
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.summary = None
+        self.since = None
+        self.until = None
+
+    def update(self, series, start):
+        if self.summary is not None and start < self.since:
+            earlier = summarize(*series.read(start, self.since), self.resolution)
+            self.summary = earlier.extend(self.summary)
+            self.since = start
+
+        timestamps, values = series.read(self.until if self.summary is not None else start)
+        if not len(timestamps):
+            return
+
+        until = timestamps[-1] // self.resolution * self.resolution
+        complete = np.searchsorted(np.frombuffer(timestamps, dtype=np.int64), until)
+        if not complete:
+            return
+
+        summary = summarize(timestamps[:complete], values[:complete], self.resolution)
+        if self.summary is None:
+            self.summary = summary
+            self.since = start
+        else:
+            self.summary = self.summary.extend(summary)
+        self.until = until
+
+
+class HistoryPlugin(Plugin):
+    label = "history"
+    message_names = ()
+
+    def __init__(self, plugin_id, hub, resolutions):
+        super().__init__(plugin_id, hub)
+        self.resolutions = set(resolutions)
+        self.summaries = {}
+
+    async def on_source_message(self, source, message):
+        pass
+
+    def get_summary(self, label, name, start, end, resolution):
+        series = self.hub.store.get_series(label, name)
+        start = start // resolution * resolution
+
+        if resolution not in self.resolutions:
+            return summarize(*series.read(start, end), resolution)
+
+        cached = self.summaries.setdefault((label, name, resolution), CachedSummary(resolution))
+        cached.update(series, start)
+        if cached.summary is None:
+            return summarize(*series.read(start, end), resolution)
+
+        # Cached buckets only up to the last one that ends before end, the rest comes from the samples
+        boundary = min(end // resolution * resolution, cached.until)
+        summary = cached.summary.slice(start, boundary)
+        if end > boundary:
+            summary = summary.extend(summarize(*series.read(max(start, boundary), end), resolution))
+        return summary
+
+    async def on_client_request(self, client, client_key, request):
+        if request.get('target') != 'history':
+            return
+
+        if self.hub.store is None:
+            await self.reply(client, client_key, {'error': 'No store configured'})
+            return
+
+        label, name = request.get('label'), request.get('series')
+        if not isinstance(label, str) or not isinstance(name, str) or not self.hub.store.has_series(label, name):
+            await self.reply(client, client_key, {'error': 'Unknown series'})
+            return
+
+        try:
+            start, end = int(request['start']), int(request['end'])
+            resolution = int(request.get('resolution', 60000))
+        except (KeyError, TypeError, ValueError):
+            start = end = resolution = 0
+        if resolution <= 0 or end <= start:
+            await self.reply(client, client_key, {'error': 'Invalid range'})
+            return
+
+        await self.reply(client, client_key, {
+            'label': label,
+            'series': name,
+            'resolution': resolution,
+            'buckets': self.get_summary(label, name, start, end, resolution).as_dict(),
+        })
+
+
+def from_config(plugin_id, config, hub):
+    resolutions = DEFAULT_RESOLUTIONS
+    if 'resolutions' in config:
+        resolutions = [int(i) for i in config['resolutions'].split()]
+    return HistoryPlugin(plugin_id, hub, resolutions)
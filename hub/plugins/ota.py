@@ -1,43 +1,169 @@
 import asyncio
-from io import StringIO
+import zlib
 
-from intelhex import IntelHex
+from websockets.exceptions import ConnectionClosed
 
 from .base import Plugin
+from ..firmware import FirmwareCache
+
+
+class Block:
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+        self.checksum = zlib.crc32(data)
+
+    @property
+    def erased(self):
+        return not self.data.strip(b'\xff')
+
+
+class Transfer:
+    def __init__(self, image, blocks):
+        self.image = image
+        self.blocks = blocks
+        self.acknowledged = set()
+
+    @property
+    def remaining(self):
+        return [block for block in self.blocks if block.address not in self.acknowledged]
+
+    @property
+    def progress(self):
+        return {
+            'sent': len(self.acknowledged),
+            'total': len(self.blocks),
+        }
 
 
 class OtaPlugin(Plugin):
-    block_size = 512
+    label = "ota"
+    message_names = ()
 
-    def __init__(self, plugin_id, hub, source_target):
+    def __init__(self, plugin_id, hub, source_target, firmware, block_size=512, window=4, retries=5,
+                 retry_delay=3.0):
         super().__init__(plugin_id, hub)
         self.source_target = source_target
+        self.dependencies = (source_target.id,) if source_target is not None else ()
+        self.firmware = firmware
+        self.block_size = block_size
+        self.window = window
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+        # Transfers in progress per address. Retries within one resume where they left off, a new request
+        # starts over since the node starts over on a fresh ota.start.
+        self.transfers = {}
 
     async def on_source_message(self, source, message):
         pass
 
+    def get_source(self, address):
+        return self.hub.get_source(address, self.source_target)
+
     async def on_client_request(self, client, client_key, request):
         if request.get('target') == 'ota':
-            await self.program(client, request['address'], request['data'])
+            # Flashing takes minutes, don't hold up the request workers
+            self.hub.scheduler.run_long(self.program(client, client_key, request['address'], request['data']))
+
+    async def report(self, client, client_key, progress):
+        # Flashing goes on when the client that asked for it drops off, it just doesn't hear about it
+        try:
+            await self.reply(client, client_key, progress)
+        except ConnectionClosed:
+            pass
+
+    async def get_transfer(self, address, data):
+        image = await self.firmware.load(data)
+
+        # Only send what differs from the image we flashed last time, or what isn't erased flash otherwise
+        previous = await self.firmware.last_flashed(address)
+
+        blocks = []
+        for addr in range(0, len(image), self.block_size):
+            block = Block(addr, image.data[addr:addr + self.block_size])
+            if previous is not None:
+                if block.data != previous.block(addr, len(block.data)):
+                    blocks.append(block)
+            elif not block.erased:
+                blocks.append(block)
+
+        return Transfer(image, blocks)
+
+    async def send_block(self, client, client_key, address, transfer, block, window):
+        async with window:
+            response = await self.get_source(address).request(
+                address, 'ota.block',
+                memaddr=block.address, size=len(block.data), data=block.data, crc=block.checksum,
+            )
+
+        if response is None or isinstance(response, dict) and response.get('error'):
+            return
+
+        transfer.acknowledged.add(block.address)
+        await self.report(client, client_key, dict(address=address, state='block', **transfer.progress))
+
+    async def send_blocks(self, client, client_key, address, transfer):
+        window = asyncio.Semaphore(self.window)
+        await asyncio.gather(*[
+            self.send_block(client, client_key, address, transfer, block, window)
+            for block in transfer.remaining
+        ])
+
+    async def start(self, address):
+        for _ in range(self.retries):
+            if await self.get_source(address).request(address, 'ota.start', address=address) is not None:
+                return True
+            await asyncio.sleep(self.retry_delay)
+        return False
+
+    async def program(self, client, client_key, address, data):
+        if self.get_source(address) is None:
+            await self.report(client, client_key, dict(address=address, state='failed', error='No source for address'))
+            return
+        if address in self.transfers:
+            await self.report(client, client_key, dict(address=address, state='failed', error='Already programming'))
+            return
 
-    async def program(self, client, address, data):
-        await self.source_target.command(address, 'otamode')
+        self.transfers[address] = None
+        try:
+            self.transfers[address] = transfer = await self.get_transfer(address, data)
+            await self.send_transfer(client, client_key, address, transfer)
+        finally:
+            del self.transfers[address]
 
-        file_data = StringIO(data.decode('utf-8'))
-        hex_file = IntelHex(file_data)
-        hex_size = len(hex_file)
+    async def send_transfer(self, client, client_key, address, transfer):
+        await self.report(client, client_key, dict(address=address, state='start', **transfer.progress))
 
-        await asyncio.sleep(3)
+        await self.get_source(address).command(address, 'otamode')
+        if not await self.start(address):
+            await self.report(client, client_key, dict(address=address, state='failed', **transfer.progress))
+            return
 
-        print(await self.source_target.request(address, 'ota.start', address=address))
-        for addr in range(0, hex_size, self.block_size):
-            bsize = min(self.block_size, hex_size - addr)
-            data = hex_file.tobinstr(start=addr, size=bsize)
-            if len(data) > 0:
-                print(await self.source_target.request(address, 'ota.block', memaddr=addr, size=len(data), data=data))
+        for _ in range(self.retries):
+            await self.send_blocks(client, client_key, address, transfer)
+            if not transfer.remaining:
+                break
+            # Timeouts or a bridge reconnect, retry what wasn't acknowledged yet
+            await asyncio.sleep(self.retry_delay)
+        else:
+            await self.report(client, client_key, dict(address=address, state='failed', **transfer.progress))
+            return
 
-        await self.source_target.request(0, 'ota.end')
+        await self.get_source(address).request(0, 'ota.end')
+        await self.firmware.set_flashed(address, transfer.image)
+        await self.report(client, client_key, dict(address=address, state='done', **transfer.progress))
 
 
 def from_config(plugin_id, config, hub):
-    return OtaPlugin(plugin_id, hub, hub.sources['bridge'])
+    return OtaPlugin(
+        plugin_id,
+        hub,
+        # Nodes not in the address routing table are reached through this source, if there is one
+        hub.sources.get(config.get('source', 'bridge')),
+        FirmwareCache(config.get('cache')),
+        block_size=config.getint('block_size', 512),
+        window=config.getint('window', 4),
+        retries=config.getint('retries', 5),
+        retry_delay=config.getfloat('retry_delay', 3.0),
+    )
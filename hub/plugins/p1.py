@@ -1,13 +1,20 @@
 from datetime import datetime
 
 from .base import Plugin
+from ..window import RollingWindow
 
 
 class P1Plugin(Plugin):
     label = "p1"
+    message_names = ('p1',)
 
     state = None
     timestamp = None
+    consumption = None
+
+    def __init__(self, plugin_id, hub, average_window=300000, average_size=512):
+        super().__init__(plugin_id, hub)
+        self.consumption = RollingWindow(average_size, average_window)
 
     @property
     def energy_delivered(self):
@@ -29,6 +36,10 @@ class P1Plugin(Plugin):
     def energy_consumption(self):
         return self.energy_delivered_current - self.energy_returned_current
 
+    @property
+    def energy_consumption_average(self):
+        return self.consumption.mean
+
     @property
     def gas_delivered(self):
         return self.state['g_d']
@@ -41,6 +52,7 @@ class P1Plugin(Plugin):
             'energy_returned': self.energy_returned,
             'energy_returned_current': self.energy_returned_current,
             'energy_consumption': self.energy_consumption,
+            'energy_consumption_average': self.energy_consumption_average,
             'gas_delivered': self.gas_delivered,
             'timestamp': self.timestamp,
         }
@@ -49,24 +61,44 @@ class P1Plugin(Plugin):
         # source.command(name='p1.get', address=self.meter_address, callback=self.handle_p1)
         pass
 
+    def get_state(self):
+        if not self.state:
+            return None
+        return {
+            'state': self.state,
+            'timestamp': self.timestamp,
+            'consumption': [[int(t), v] for t, v in self.consumption.items()],
+        }
+
+    def set_state(self, state):
+        self.state = state['state']
+        self.timestamp = state['timestamp']
+        self.consumption.clear()
+        for timestamp, value in state.get('consumption', ()):
+            self.consumption.append(timestamp, value)
+        self.publish(self.readings)
+
     async def update_p1(self, data):
         self.state = data
         self.timestamp = int(datetime.now().timestamp() * 1000)
 
         if self.state:
-            await self.broadcast(self.readings)
+            self.consumption.append(self.timestamp, self.energy_consumption)
+            readings = self.readings
+            self.record(readings, self.timestamp)
+            await self.broadcast(readings)
 
     async def on_source_message(self, source, message):
-        if 'name' in message and message['name'] == 'p1':
-            await self.update_p1(message["data"])
-
-    async def on_client_connect(self, client, client_key):
-        if self.state:
-            await self.reply(client, client_key, self.readings)
+        await self.update_p1(message["data"])
 
     async def on_client_request(self, client, client_key, request):
         pass
 
 
 def from_config(plugin_id, config, hub):
-    return P1Plugin(plugin_id, hub)
+    return P1Plugin(
+        plugin_id,
+        hub,
+        average_window=config.getint('average_window', 300000),
+        average_size=config.getint('average_size', 512),
+    )
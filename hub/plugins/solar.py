@@ -1,42 +1,36 @@
 from datetime import datetime
 
 from .base import Plugin
+from ..window import RollingWindow
 
 
 class SolarPlugin(Plugin):
     label = "solar"
+    message_names = ('solar',)
 
-    solar_states = None
-    solar_timestamps = None
+    samples = None
 
-    def __init__(self, plugin_id, hub, source_target):
+    def __init__(self, plugin_id, hub, source_target, address=4, window=10, window_span=None):
         super().__init__(plugin_id, hub)
-        self.solar_states = []
-        self.solar_timestamps = []
+        self.address = address
+        self.samples = RollingWindow(window, window_span)
         self.source_target = source_target
+        self.message_sources = (source_target.id,)
+        self.dependencies = (source_target.id,)
+        self.publish(self.readings)
 
     @property
     def production(self):
-        if len(self.solar_states) < 2:
-            return 0
-
-        def _get_production(diff, t1, t2):
-            if t1 == t2:
-                return 0
-            return diff // ((t2 - t1) / 3600000)
-
-        produced = _get_production(self.solar_states[-1] - self.solar_states[-2], self.solar_timestamps[-2],
-                                   self.solar_timestamps[-1])
-
-        return produced
+        # Fitted over the whole window instead of the last two samples, per hour
+        return int(round(self.samples.rate(3600000)))
 
     @property
     def delivered(self):
-        return self.solar_states[-1] if self.solar_states else 0
+        return self.samples.last[1] if self.samples else 0
 
     @property
     def timestamp(self):
-        return self.solar_timestamps[-1] if self.solar_timestamps else None
+        return int(self.samples.last[0]) if self.samples else None
 
     @property
     def readings(self):
@@ -46,38 +40,58 @@ class SolarPlugin(Plugin):
             'timestamp': self.timestamp,
         }
 
+    def get_state(self):
+        if not self.samples:
+            return None
+        timestamps, states = zip(*self.samples.items())
+        return {'states': list(states), 'timestamps': [int(t) for t in timestamps]}
+
+    def set_state(self, state):
+        self.samples.clear()
+        for timestamp, solar_value in zip(state['timestamps'], state['states']):
+            self.samples.append(timestamp, solar_value)
+        self.publish(self.readings)
+
     async def update_solar(self, solar_value, reset=False):
         if reset:
-            self.solar_states = []
-            self.solar_timestamps = []
+            self.samples.clear()
 
-        self.solar_states.append(solar_value)
-        self.solar_timestamps.append(int(datetime.now().timestamp() * 1000))
-        self.solar_states = self.solar_states[-10:]
-        self.solar_timestamps = self.solar_timestamps[-10:]
+        self.samples.append(int(datetime.now().timestamp() * 1000), solar_value)
 
-        if self.solar_states:
-            await self.broadcast(self.readings)
+        if self.samples:
+            readings = self.readings
+            self.record(readings, self.timestamp)
+            await self.broadcast(readings)
 
     async def on_source_connect(self, source):
         if source == self.source_target:
-            solar_value = await source.request(4, 'solar.get')
+            solar_value = await source.request(self.address, 'solar.get')
             if solar_value and 'solar' in solar_value:
                 await self.update_solar(solar_value['solar'])
 
     async def on_source_message(self, source, message):
-        if 'name' in message and message['name'] == 'solar':
-            await self.update_solar(message["data"]["solar"])
-
-    async def on_client_connect(self, client, client_key):
-        await self.reply(client, client_key, self.readings)
+        await self.update_solar(message["data"]["solar"])
 
     async def on_client_request(self, client, client_key, request):
         if request.get('target') == 'solar':
-            solar_value = await self.source_target.request(4, 'solar.set', solar=request.get('data', 0))
+            solar_value = await self.source_target.request(self.address, 'solar.set', solar=request.get('data', 0))
             if solar_value and 'solar' in solar_value:
                 await self.update_solar(solar_value['solar'], reset=True)
 
 
 def from_config(plugin_id, config, hub):
-    return SolarPlugin(plugin_id, hub, hub.sources['bridge'])
+    address = config.getint('address', 4)
+    source_target = hub.get_source(address, hub.sources.get(config.get('source', 'bridge')))
+    if source_target is None:
+        raise ValueError("No source for solar address {} in [{}], add it to the addresses of a source".format(
+            address, plugin_id,
+        ))
+
+    return SolarPlugin(
+        plugin_id,
+        hub,
+        source_target,
+        address=address,
+        window=config.getint('window', 10),
+        window_span=config.getint('window_span'),
+    )
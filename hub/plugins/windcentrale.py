@@ -6,6 +6,7 @@ from ..sources.windcentrale import WINDMILLS
 class WindcentralePlugin(Plugin):
     label = "windcentrale"
     name = "Windcentrale"
+    message_names = ('windmill',)
 
     mills = None
     mill_data = None
@@ -13,27 +14,36 @@ class WindcentralePlugin(Plugin):
     def __init__(self, plugin_id, hub, mills):
         super().__init__(plugin_id, hub)
         self.mills = dict(mills)
+        self.names = dict(WINDMILLS)
         self.mill_data = {}
 
+    def get_state(self):
+        return list(self.mill_data.values()) or None
+
+    def set_state(self, state):
+        # Only mills that are still configured
+        self.mill_data = dict((mill['id'], mill) for mill in state if mill['id'] in self.mills)
+        if self.mill_data:
+            self.publish(list(self.mill_data.values()))
+
     async def on_source_message(self, source, message):
-        if 'name' in message and message['name'] == 'windmill':
-            mill_id = message["data"]["id"]
-            amount = self.mills[mill_id]
-            state = {
-                'id': mill_id,
-                'power': message["data"]["per_share"] * amount,
-                'performance': message["data"]["performance"],
-                'timestamp': int(datetime.now().timestamp() * 1000),
-                'name': dict(WINDMILLS)[mill_id],
-            }
-            self.mill_data[mill_id] = state
-
-            if self.mill_data:
-                await self.broadcast(list(self.mill_data.values()))
-
-    async def on_client_connect(self, client, client_key):
+        mill_id = message["data"]["id"]
+        amount = self.mills[mill_id]
+        state = {
+            'id': mill_id,
+            'power': message["data"]["per_share"] * amount,
+            'performance': message["data"]["performance"],
+            'timestamp': int(datetime.now().timestamp() * 1000),
+            'name': self.names[mill_id],
+        }
+        self.mill_data[mill_id] = state
+        self.record({
+            '{}.power'.format(mill_id): state['power'],
+            '{}.performance'.format(mill_id): state['performance'],
+        }, state['timestamp'])
+
         if self.mill_data:
-            await self.reply(client, client_key, list(self.mill_data.values()))
+            await self.broadcast(list(self.mill_data.values()))
 
     async def on_client_request(self, client, client_key, request):
         pass
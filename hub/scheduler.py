@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class RequestScheduler:
+    def __init__(self, handler, workers=4, long_running=1):
+        self.handler = handler
+        self.workers = workers
+        self.pending = {}
+        self.ready = asyncio.Queue()
+
+        self.long_running = asyncio.Semaphore(long_running)
+        self.long_tasks = set()
+
+    def submit(self, client, message):
+        # A client is only ever handed to one worker at a time, which keeps its requests in order
+        queue = self.pending.get(client)
+        if queue is not None:
+            queue.append(message)
+        else:
+            self.pending[client] = deque([message])
+            self.ready.put_nowait(client)
+
+    def run_long(self, coro):
+        task = asyncio.ensure_future(self._run_long(coro))
+        self.long_tasks.add(task)
+        task.add_done_callback(self.long_tasks.discard)
+        return task
+
+    async def _run_long(self, coro):
+        async with self.long_running:
+            try:
+                return await coro
+            except Exception:
+                logger.exception('Long running request failed')
+
+    async def worker(self):
+        while True:
+            client = await self.ready.get()
+            queue = self.pending[client]
+            try:
+                await self.handler(client, queue.popleft())
+            except Exception:
+                logger.exception('Request failed')
+            finally:
+                if queue:
+                    self.ready.put_nowait(client)
+                else:
+                    del self.pending[client]
+
+    async def get_task(self):
+        await asyncio.wait([asyncio.ensure_future(self.worker()) for _ in range(self.workers)])
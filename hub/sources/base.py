@@ -2,11 +2,20 @@ import asyncio
 
 
 class Source:
-    outgoing = asyncio.Queue()
+    outgoing = None
     id = None
 
-    def __init__(self, source_id):
+    # Node addresses reached through this source, for the hub's address routing table
+    addresses = ()
+
+    def __init__(self, source_id, addresses=()):
         self.id = source_id
+        self.addresses = tuple(addresses)
+        self.outgoing = asyncio.Queue()
+
+    def stats(self):
+        # Numbers worth exposing as metrics, by name. The names should not change while the source runs.
+        return {}
 
     def get_task(self, hub):
         raise NotImplementedError
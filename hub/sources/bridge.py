@@ -1,50 +1,167 @@
 import asyncio
+import logging
+import random
+from collections import deque
+
 import flynn
 
 import websockets
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
 
 from .base import Source
 
+logger = logging.getLogger(__name__)
+
 
 class BridgeSource(Source):
-    current_id = 0
-    current_id_lock = asyncio.Lock()
+    current_id = None
+    current_id_lock = None
+
+    pending = None
 
-    events = None
-    results = None
+    # Seconds over which requests_per_second is measured
+    rate_interval = 10
 
-    def __init__(self, source_id, target):
-        super().__init__(source_id)
+    def __init__(self, source_id, target, window=8, timeout=5.0, idempotent=(), backoff=1.0, max_backoff=60.0,
+                 metrics=None, addresses=()):
+        super().__init__(source_id, addresses)
         self.target = target
-        self.events = {}
-        self.results = {}
+        # Command ids are only matched against replies from this bridge
+        self.current_id = 0
+        self.current_id_lock = asyncio.Lock()
+        self.metrics = metrics
+        self.timeout = timeout
+        self.window = asyncio.Semaphore(window)
+        self.pending = {}
+
+        # Requests that are safe to send again after a reconnect, and which of those went out already
+        self.idempotent = set(idempotent)
+        self.replayable = {}
+        self.written = set()
+
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+
+        self.requests = 0
+        self.timeouts = 0
+        self.round_trips = 0
+        self.round_trip_total = 0.0
+        self.round_trip_max = 0.0
+        self.sent = deque()
+
+    @property
+    def requests_per_second(self):
+        self._expire_sent(asyncio.get_event_loop().time())
+        return len(self.sent) / self.rate_interval
+
+    @property
+    def round_trip_mean(self):
+        return self.round_trip_total / self.round_trips if self.round_trips else 0.0
+
+    def _expire_sent(self, now):
+        while self.sent and self.sent[0] < now - self.rate_interval:
+            self.sent.popleft()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'requests_per_second': self.requests_per_second,
+            'in_flight': len(self.pending),
+            'timeouts': self.timeouts,
+            'reconnects': self.reconnects,
+            'round_trip_mean': self.round_trip_mean,
+            'round_trip_max': self.round_trip_max,
+        }
 
     async def get_task(self, hub):
-        bridge = await websockets.connect(self.target)
+        loop = asyncio.get_event_loop()
+        wait_time = self.backoff
         while True:
-            producer_task = asyncio.ensure_future(bridge.recv())
-            listener_task = asyncio.ensure_future(self.outgoing.get())
-
-            done, pending = await asyncio.wait(
-                [listener_task, producer_task],
-                return_when=asyncio.FIRST_COMPLETED
-            )
-
-            if listener_task in done:
-                message = listener_task.result()
-                await bridge.send(flynn.dumps(message))
+            try:
+                bridge = await websockets.connect(self.target)
+            except (ConnectionRefusedError, OSError, InvalidHandshake):
+                pass
             else:
-                listener_task.cancel()
+                connected = loop.time()
+                try:
+                    await self.handle_bridge(bridge, hub)
+                except (ConnectionClosed, OSError):
+                    pass
+                except Exception:
+                    logger.exception('Lost bridge %s', self.id)
+                self.reconnects += 1
+
+                # Only a connection that lasted a while resets the backoff, one that drops right away doesn't
+                if loop.time() - connected > self.max_backoff:
+                    wait_time = self.backoff
+
+            # We will wait a while before reconnecting, with some jitter so hubs don't reconnect in lockstep
+            await asyncio.sleep(wait_time * random.uniform(0.5, 1.5))
+            wait_time = min(wait_time * 2, self.max_backoff)
+
+    async def handle_bridge(self, bridge, hub):
+        try:
+            # Sent before the connection dropped, and unanswered. Whatever wasn't sent yet is still queued.
+            for command_id, message in list(self.replayable.items()):
+                if command_id in self.written:
+                    await bridge.send(flynn.dumps(message))
+
+            reader = asyncio.ensure_future(self.read(bridge, hub))
+            writer = asyncio.ensure_future(self.write(bridge))
+
+            # Let plugins (re)sync their state, they need the reader running for that
+            asyncio.ensure_future(hub.handle_connect(self))
+
+            try:
+                done, _ = await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            finally:
+                reader.cancel()
+                writer.cancel()
+        finally:
+            self.fail_pending()
+            await bridge.close()
 
-            if producer_task in done:
-                message = flynn.loads(producer_task.result())
+    async def read(self, bridge, hub):
+        while True:
+            message = flynn.loads(await bridge.recv())
 
-                if 'id' in message:  # reply
-                    await self.set_result(message['id'], message)
-                else:
-                    await hub.handle_incoming(self, message)
+            if 'id' in message:  # reply
+                future = self.pending.get(message['id'])
+                if future is not None and not future.done():
+                    future.set_result(message.get('data'))
             else:
-                producer_task.cancel()
+                await hub.handle_incoming(self, message)
+
+    async def write(self, bridge):
+        while True:
+            message, future = await self.outgoing.get()
+            # The caller gave up on it already, timed out or cancelled while we were waiting to send
+            if future is not None and future.done():
+                continue
+
+            # Marked before sending, if the connection drops halfway it might have gone out
+            if message['id'] in self.replayable:
+                self.written.add(message['id'])
+            await bridge.send(flynn.dumps(message))
+
+    def fail_pending(self):
+        for command_id, future in self.pending.items():
+            if command_id not in self.replayable and not future.done():
+                future.set_exception(ConnectionError('Bridge connection closed'))
+
+        # Whatever is still queued must not run on the next connection: requests whose callers were just told
+        # they failed, and commands that were meant for this one. Replayable requests stay queued, those go out
+        # once after reconnecting.
+        queued = []
+        while not self.outgoing.empty():
+            message, future = self.outgoing.get_nowait()
+            if message['id'] in self.replayable:
+                queued.append((message, future))
+        for item in queued:
+            self.outgoing.put_nowait(item)
 
     async def get_command_id(self):
         async with self.current_id_lock:
@@ -52,39 +169,68 @@ class BridgeSource(Source):
             cmd_id = self.current_id
         return cmd_id
 
-    async def get_response(self, cmd_id):
-        event = self.events.setdefault(cmd_id, asyncio.Event())
-        try:
-            await asyncio.wait_for(event.wait(), 5.0)
-        finally:
-            event.clear()
-            del self.events[cmd_id]
-            return self.results.pop(cmd_id, None)
-
-    async def set_result(self, command_id, data):
-        self.results[command_id] = data['data']
-        event = self.events.setdefault(command_id, asyncio.Event())
-        event.set()
-
     async def command(self, target_address, command, **kwargs):
         command_id = await self.get_command_id()
-        await self.outgoing.put({
-            "address": target_address,
-            "id": command_id,
-            "name": command,
-            "args": kwargs,
-        })
-
-    async def request(self, target_address, command, **kwargs):
-        command_id = await self.get_command_id()
-        await self.outgoing.put({
+        # Queued with the future of the request it belongs to, commands have none
+        await self.outgoing.put(({
             "address": target_address,
             "id": command_id,
             "name": command,
             "args": kwargs,
-        })
-        return await self.get_response(command_id)
+        }, None))
+
+    async def request(self, target_address, command, timeout=None, **kwargs):
+        loop = asyncio.get_event_loop()
+
+        async with self.window:
+            command_id = await self.get_command_id()
+            future = self.pending[command_id] = loop.create_future()
+
+            sent = loop.time()
+            self.requests += 1
+            self.sent.append(sent)
+            self._expire_sent(sent)
+
+            message = {
+                "address": target_address,
+                "id": command_id,
+                "name": command,
+                "args": kwargs,
+            }
+            if command in self.idempotent:
+                self.replayable[command_id] = message
+
+            await self.outgoing.put((message, future))
+            try:
+                result = await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            except ConnectionError:
+                return None
+            finally:
+                del self.pending[command_id]
+                self.replayable.pop(command_id, None)
+                self.written.discard(command_id)
+
+            round_trip = loop.time() - sent
+            self.round_trips += 1
+            self.round_trip_total += round_trip
+            self.round_trip_max = max(self.round_trip_max, round_trip)
+            if self.metrics is not None:
+                self.metrics.observe('bridge_round_trip_seconds', round_trip, source=self.id)
+            return result
 
 
 def from_config(source_id, config, hub):
-    return BridgeSource(source_id, config.get('url', 'ws://127.0.0.1:9876'))
+    return BridgeSource(
+        source_id,
+        config.get('url', 'ws://127.0.0.1:9876'),
+        window=config.getint('window', 8),
+        timeout=config.getfloat('timeout', 5.0),
+        idempotent=config.get('idempotent', 'solar.get').split(),
+        backoff=config.getfloat('backoff', 1.0),
+        max_backoff=config.getfloat('max_backoff', 60.0),
+        metrics=hub.metrics,
+        addresses=[int(i) for i in config.get('addresses', '').split()],
+    )
@@ -1,8 +1,7 @@
 import asyncio
-from asyncio.futures import TimeoutError
+import random
 
 import aiohttp
-from aiohttp.errors import ServerDisconnectedError
 from yarl import URL
 
 from .base import Source
@@ -19,39 +18,69 @@ WINDMILLS = (
 class WindcentralSource(Source):
     name = "windcentale"
 
-    def __init__(self, source_id, mills):
+    def __init__(self, source_id, mills, live_url=WINDCENTRALE_LIVE, backoff=5.0, max_backoff=300.0):
         super().__init__(source_id)
         self.mills = list(mills)
+        self.live_url = live_url
+        self.backoff = backoff
+        self.max_backoff = max_backoff
 
-    @classmethod
-    async def get_mill_info(cls, session, mill, hub):
+        # Only the newest sample per mill is kept until it is dispatched, so the queue holds each mill once at most
+        self.latest = {}
+        self.updated = asyncio.Queue(maxsize=len(self.mills))
+
+    @staticmethod
+    def parse_line(mill, line):
+        line = line.decode('utf8').strip().split(',')
+        return {
+            'id': mill,
+            'wind': line[0],
+            'mill_total': int(line[1]),
+            'per_share': int(line[2]),
+            'performance': int(line[3]),
+        }
+
+    def add_sample(self, mill, sample):
+        if mill not in self.latest:
+            self.updated.put_nowait(mill)
+        self.latest[mill] = sample
+
+    async def get_mill_info(self, session, mill):
+        wait_time = self.backoff
         while True:
             try:
-                async with session.get(URL(WINDCENTRALE_LIVE.format(id=mill), encoded=True)) as response:
-                    if response.status != 200:
-                        break
-
-                    async for line in response.content:
-                        line = line.decode('utf8').strip().split(',')
-                        await hub.handle_incoming(cls, {
-                            'name': 'windmill',
-                            'data': {
-                                'id': mill,
-                                'wind': line[0],
-                                'mill_total': int(line[1]),
-                                'per_share': int(line[2]),
-                                'performance': int(line[3]),
-                            },
-                        })
-            except (ServerDisconnectedError, TimeoutError, IndexError):
-                await asyncio.sleep(5)
+                async with session.get(URL(self.live_url.format(id=mill), encoded=True)) as response:
+                    if response.status == 200:
+                        wait_time = self.backoff
+
+                        async for line in response.content:
+                            try:
+                                self.add_sample(mill, self.parse_line(mill, line))
+                            except (IndexError, ValueError):
+                                pass
+            except (aiohttp.ClientError, aiohttp.ServerDisconnectedError, asyncio.TimeoutError):
+                pass
+
+            # We will wait a while before reconnecting
+            await asyncio.sleep(wait_time * random.uniform(0.5, 1.5))
+            wait_time = min(wait_time * 2, self.max_backoff)
+
+    async def dispatch(self, hub):
+        while True:
+            mill = await self.updated.get()
+            await hub.handle_incoming(self, {
+                'name': 'windmill',
+                'data': self.latest.pop(mill),
+            })
 
     async def get_task(self, hub):
+        await hub.handle_connect(self)
+
         async with aiohttp.ClientSession() as session:
-            fetchers = [asyncio.ensure_future(self.get_mill_info(session, mill, hub))
-                        for mill, _ in self.mills]
+            tasks = [asyncio.ensure_future(self.get_mill_info(session, mill)) for mill, _ in self.mills]
+            tasks.append(asyncio.ensure_future(self.dispatch(hub)))
 
-            await asyncio.wait(fetchers)
+            await asyncio.wait(tasks)
 
 
 def from_config(source_id, config, hub):
@@ -59,4 +88,10 @@ def from_config(source_id, config, hub):
     mills = [i.split(':') for i in config.get('mills').split(',')]
     mills = ((mill_ids[k], int(v)) for (k, v) in mills)
 
-    return WindcentralSource(source_id, mills)
+    return WindcentralSource(
+        source_id,
+        mills,
+        live_url=config.get('live_url', WINDCENTRALE_LIVE),
+        backoff=config.getfloat('backoff', 5.0),
+        max_backoff=config.getfloat('max_backoff', 300.0),
+    )
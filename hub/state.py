@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    # Plugin state by plugin id in a single JSON file, so a restart doesn't start from nothing.
+    # Not CBOR: flynn can't decode the floats meter readings are full of.
+
+    def __init__(self, path, interval=60):
+        self.path = path
+        self.interval = interval
+        self.versions = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.path, 'r') as f:
+                states = json.load(f)
+            if not isinstance(states, dict):
+                raise ValueError('Expected a mapping of plugin ids')
+            return states
+        except Exception:
+            # Starting without state beats not starting at all
+            logger.exception("Could not read plugin state from '%s', starting empty", self.path)
+            return {}
+
+    def restore(self, plugins):
+        states = self.load()
+        for plugin in plugins.values():
+            if states.get(plugin.id) is None:
+                continue
+
+            try:
+                plugin.set_state(states[plugin.id])
+            except Exception:
+                logger.exception("Could not restore state of plugin '%s'", plugin.id)
+        self.versions = self.get_versions(plugins)
+
+    @staticmethod
+    def get_versions(plugins):
+        return dict((plugin.id, plugin.version) for plugin in plugins.values())
+
+    def save(self, plugins):
+        # Versions only move when the state changed, skip writing if none of them did
+        versions = self.get_versions(plugins)
+        if versions == self.versions:
+            return
+
+        states = {}
+        for plugin in plugins.values():
+            state = plugin.get_state()
+            if state is not None:
+                states[plugin.id] = state
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(states, f, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+        self.versions = versions
+
+    async def get_task(self, plugins):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.save(plugins)
+        finally:
+            self.save(plugins)
+
+
+def from_config(config):
+    return StateStore(
+        config.get('path', 'state.json'),
+        interval=config.getfloat('interval', 60),
+    )
@@ -0,0 +1,157 @@
+import asyncio
+import bisect
+import mmap
+import os
+import re
+from array import array
+from contextlib import contextmanager
+
+TIMESTAMP_TYPE = 'q'
+VALUE_TYPE = 'd'
+
+SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+@contextmanager
+def mapped(path, typecode):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        yield array(typecode)
+        return
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        view = memoryview(mapping).cast(typecode)
+        try:
+            yield view
+        finally:
+            view.release()
+
+
+class Series:
+    # Append-only columns of timestamps (ms) and values, buffered in memory and flushed in batches
+
+    def __init__(self, path):
+        self.timestamps_path = path + '.ts'
+        self.values_path = path + '.val'
+        self.timestamps = array(TIMESTAMP_TYPE)
+        self.values = array(VALUE_TYPE)
+        self.last = None
+
+        self.repair()
+        with mapped(self.timestamps_path, TIMESTAMP_TYPE) as stored_timestamps:
+            if len(stored_timestamps):
+                self.last = stored_timestamps[-1]
+
+    def repair(self):
+        # A crash between writing both columns leaves one longer than the other
+        columns = [(path, array(typecode).itemsize) for path, typecode in (
+            (self.timestamps_path, TIMESTAMP_TYPE),
+            (self.values_path, VALUE_TYPE),
+        )]
+        sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path, _ in columns]
+
+        count = min(size // item_size for size, (_, item_size) in zip(sizes, columns))
+        for size, (path, item_size) in zip(sizes, columns):
+            if size != count * item_size:
+                with open(path, 'r+b') as f:
+                    f.truncate(count * item_size)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, value):
+        # Reads rely on timestamps being sorted
+        if self.last is not None and timestamp < self.last:
+            timestamp = self.last
+        self.last = timestamp
+
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def flush(self):
+        if not self.timestamps:
+            return
+
+        os.makedirs(os.path.dirname(self.timestamps_path), exist_ok=True)
+        with open(self.timestamps_path, 'ab') as f:
+            self.timestamps.tofile(f)
+        with open(self.values_path, 'ab') as f:
+            self.values.tofile(f)
+
+        self.timestamps = array(TIMESTAMP_TYPE)
+        self.values = array(VALUE_TYPE)
+
+    def read(self, start=None, end=None):
+        timestamps = array(TIMESTAMP_TYPE)
+        values = array(VALUE_TYPE)
+
+        with mapped(self.timestamps_path, TIMESTAMP_TYPE) as stored_timestamps:
+            low, high = self._range(stored_timestamps, start, end)
+            timestamps.frombytes(memoryview(stored_timestamps[low:high]).cast('B'))
+        if high > low:
+            with mapped(self.values_path, VALUE_TYPE) as stored_values:
+                values.frombytes(memoryview(stored_values[low:high]).cast('B'))
+
+        low, high = self._range(self.timestamps, start, end)
+        timestamps.extend(self.timestamps[low:high])
+        values.extend(self.values[low:high])
+
+        return timestamps, values
+
+    @staticmethod
+    def _range(timestamps, start, end):
+        low = 0 if start is None else bisect.bisect_left(timestamps, start)
+        high = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+        return low, max(low, high)
+
+
+class Store:
+    # Sharded on disk as <path>/<label>/<series>.{ts,val}
+
+    def __init__(self, path, flush_interval=10, flush_size=256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.series = dict()
+
+    def get_path(self, label, name):
+        return os.path.join(self.path, SAFE_NAME.sub('_', label), SAFE_NAME.sub('_', name))
+
+    def get_series(self, label, name):
+        key = (label, name)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series(self.get_path(label, name))
+        return series
+
+    def has_series(self, label, name):
+        return (label, name) in self.series or os.path.exists(self.get_path(label, name) + '.ts')
+
+    def append(self, label, name, value, timestamp):
+        series = self.get_series(label, name)
+        series.append(timestamp, value)
+
+        if len(series) >= self.flush_size:
+            series.flush()
+
+    def read(self, label, name, start=None, end=None):
+        return self.get_series(label, name).read(start, end)
+
+    def flush(self):
+        for series in self.series.values():
+            series.flush()
+
+    async def get_task(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            self.flush()
+
+
+def from_config(config):
+    return Store(
+        config.get('path', 'store'),
+        flush_interval=config.getfloat('flush_interval', 10),
+        flush_size=config.getint('flush_size', 256),
+    )
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import flynn
+from websockets.exceptions import ConnectionClosed
+
+from .fanout import Channel
+
+RECORD = struct.Struct('>I')
+
+
+class Spool:
+    # Frames that could not be sent upstream, kept on disk in segment files with a byte budget.
+    # When the budget runs out the oldest segment goes first.
+
+    def __init__(self, path, budget=16 * 1024 * 1024, segment_size=256 * 1024):
+        self.path = path
+        self.budget = budget
+        self.segment_size = segment_size
+        self.segments = []
+        self.size = 0
+        self.tail_size = 0
+        self.dropped = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.spool'):
+                self.segments.append(int(name[:-len('.spool')]))
+                self.tail_size = os.path.getsize(self.segment_path(self.segments[-1]))
+                self.size += self.tail_size
+        self.trim()
+
+    def __len__(self):
+        return self.size
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, '{:016d}.spool'.format(segment))
+
+    def extend(self, frames):
+        for frame in frames:
+            self.append(frame)
+
+    def append(self, frame):
+        if not self.segments or self.tail_size >= self.segment_size:
+            self.segments.append(self.segments[-1] + 1 if self.segments else 0)
+            self.tail_size = 0
+
+        with open(self.segment_path(self.segments[-1]), 'ab') as f:
+            f.write(RECORD.pack(len(frame)))
+            f.write(frame)
+        self.tail_size += RECORD.size + len(frame)
+        self.size += RECORD.size + len(frame)
+        self.trim()
+
+    def trim(self):
+        # Keep the segment being written to, even if a single frame exceeds the budget
+        while self.size > self.budget and len(self.segments) > 1:
+            self.dropped += 1
+            self.discard(self.segments[0])
+
+    def oldest(self):
+        segment = self.segments[0]
+        if segment == self.segments[-1]:
+            # Frames spooled while this one is being replayed go into a new segment
+            self.tail_size = self.segment_size
+
+        with open(self.segment_path(segment), 'rb') as f:
+            data = f.read()
+
+        frames = []
+        offset = 0
+        # A partial record at the end is what is left of a crash while writing
+        while offset + RECORD.size <= len(data):
+            length, = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if offset + length > len(data):
+                break
+            frames.append(data[offset:offset + length])
+            offset += length
+        return segment, frames
+
+    def discard(self, segment):
+        # The budget may have pushed it out already while it was being replayed
+        if segment not in self.segments:
+            return
+
+        self.segments.remove(segment)
+        path = self.segment_path(segment)
+        self.size -= os.path.getsize(path)
+        os.remove(path)
+
+
+class UpstreamChannel(Channel):
+    # Outlives the websocket. Broadcasts can be batched while connected and spooled while not, replies to
+    # upstream requests always go out on their own and only to the connection that asked.
+
+    def __init__(self, fanout, spool=None, batch_window=0.0, batch_size=1):
+        super().__init__(None, fanout)
+        self.spool = spool
+        # While disconnected only a spool makes the upstream worth broadcasting to
+        self.active = spool is not None
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+
+        # Held while sending or spooling, and while attaching
+        self.lock = asyncio.Lock()
+
+        # Spool files are written one at a time, off the event loop
+        self.spool_executor = ThreadPoolExecutor(max_workers=1) if spool is not None else None
+
+    async def spool_call(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.spool_executor, function, *args)
+
+    @staticmethod
+    def get_batch(frames):
+        if len(frames) == 1:
+            return frames[0]
+        return flynn.dumps({'batch': frames})
+
+    async def attach(self, websocket):
+        # Nothing is sent or spooled while the spool is replayed, so frames spooled in the meantime can't be missed
+        # or overtaken by newer ones. Whatever was spooled during the outage goes out before anything new.
+        async with self.lock:
+            while self.spool is not None and self.spool:
+                segment, frames = await self.spool_call(self.spool.oldest)
+                for i in range(0, len(frames), self.batch_size):
+                    await websocket.send(self.get_batch(frames[i:i + self.batch_size]))
+                await self.spool_call(self.spool.discard, segment)
+
+            self.client = websocket
+            self.fanout.set_active(self, True)
+        self.ready.set()
+
+    def detach(self):
+        self.client = None
+        self.fanout.set_active(self, self.spool is not None)
+        self.ready.set()
+
+    async def send(self, frame):
+        client = self.client
+        if client is None:
+            return False
+
+        try:
+            await client.send(frame)
+            return True
+        except ConnectionClosed:
+            if self.client is client:
+                self.client = None
+            return False
+
+    async def send_next(self):
+        label, frame = self.frames[0]
+        if label is None:
+            # A reply only makes sense to the connection that asked for it
+            self.frames.popleft()
+            await self.send(frame)
+            return
+
+        frames = []
+        while self.frames and self.frames[0][0] is not None and len(frames) < self.batch_size:
+            frames.append(bytes(self.frames.popleft()[1]))
+
+        # Without a spool, frames broadcast while disconnected are lost
+        if not await self.send(self.get_batch(frames)) and self.spool is not None:
+            await self.spool_call(self.spool.extend, frames)
+
+    async def run(self):
+        while True:
+            while not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+
+            if self.frames[0][0] is not None and self.client is not None and self.batch_size > 1:
+                # Give frames broadcast right after this one a moment to join the batch
+                await asyncio.sleep(self.batch_window)
+
+            async with self.lock:
+                # Coalescing may have emptied the queue while we waited
+                if self.frames:
+                    await self.send_next()
+
+
+def from_config(fanout, config):
+    spool = None
+    if 'spool' in config:
+        spool = Spool(config['spool'], budget=config.getint('spool_budget', 16 * 1024 * 1024))
+
+    # Batches need an upstream that knows about them, so they are off unless asked for
+    if not config.getboolean('batch', False):
+        return UpstreamChannel(fanout, spool)
+
+    return UpstreamChannel(
+        fanout,
+        spool,
+        batch_window=config.getfloat('batch_window', 0.05),
+        batch_size=config.getint('batch_size', 64),
+    )
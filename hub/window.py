@@ -0,0 +1,134 @@
+from array import array
+from collections import deque
+
+
+class RollingWindow:
+    # Fixed capacity ring of (timestamp, value) samples, optionally limited to a time span as well.
+    # Sums for the mean and the regression are kept up to date per sample, min and max with monotonic deques.
+    __slots__ = ('capacity', 'span', 'times', 'values', 'start', 'count', 'sequence', 'origin',
+                 'sum', 'sum_t', 'sum_tt', 'sum_tv', 'minima', 'maxima')
+
+    def __init__(self, capacity, span=None):
+        self.capacity = capacity
+        self.span = span
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        self.minima = deque()
+        self.maxima = deque()
+        self.clear()
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+        self.sequence = 0
+        self.origin = 0.0
+        self.sum = self.sum_t = self.sum_tt = self.sum_tv = 0.0
+        self.minima.clear()
+        self.maxima.clear()
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for position in range(self.count):
+            index = (self.start + position) % self.capacity
+            yield self.times[index], self.values[index]
+
+    def append(self, timestamp, value):
+        if self.count == self.capacity:
+            self.evict()
+        if self.span is not None:
+            while self.count and self.times[self.start] < timestamp - self.span:
+                self.evict()
+        if not self.count:
+            self.origin = timestamp
+
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count += 1
+
+        # Timestamps relative to the oldest sample keep the regression sums small enough to stay precise
+        t = timestamp - self.origin
+        self.sum += value
+        self.sum_t += t
+        self.sum_tt += t * t
+        self.sum_tv += t * value
+
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((self.sequence, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((self.sequence, value))
+        self.sequence += 1
+
+        # Once per lap around the ring, recompute the sums so rounding errors don't pile up
+        if index == self.capacity - 1:
+            self.rebase()
+
+    def evict(self):
+        sequence = self.sequence - self.count
+        t = self.times[self.start] - self.origin
+        value = self.values[self.start]
+
+        self.sum -= value
+        self.sum_t -= t
+        self.sum_tt -= t * t
+        self.sum_tv -= t * value
+
+        if self.minima[0][0] == sequence:
+            self.minima.popleft()
+        if self.maxima[0][0] == sequence:
+            self.maxima.popleft()
+
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+
+    def rebase(self):
+        self.origin = self.times[self.start]
+        self.sum = self.sum_t = self.sum_tt = self.sum_tv = 0.0
+        for timestamp, value in self.items():
+            t = timestamp - self.origin
+            self.sum += value
+            self.sum_t += t
+            self.sum_tt += t * t
+            self.sum_tv += t * value
+
+    @property
+    def first(self):
+        if not self.count:
+            return None
+        return self.times[self.start], self.values[self.start]
+
+    @property
+    def last(self):
+        if not self.count:
+            return None
+        index = (self.start + self.count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def min(self):
+        return self.minima[0][1] if self.count else None
+
+    @property
+    def max(self):
+        return self.maxima[0][1] if self.count else None
+
+    @property
+    def slope(self):
+        # Least squares change in value per unit of time over the whole window
+        if self.count < 2:
+            return 0.0
+        denominator = self.count * self.sum_tt - self.sum_t * self.sum_t
+        if denominator <= 0:
+            return 0.0
+        return (self.count * self.sum_tv - self.sum_t * self.sum) / denominator
+
+    def rate(self, per=1):
+        return self.slope * per
@@ -0,0 +1,90 @@
+import asyncio
+from configparser import ConfigParser
+
+import flynn
+import pytest
+from nacl.encoding import Base64Encoder
+from nacl.public import Box, PrivateKey
+from nacl.signing import SigningKey
+
+from hub.config import KeyInterpolation, RuntimeConfig
+from hub.fanout import FanOut
+
+
+class FakeSource:
+    def __init__(self, source_id='bridge'):
+        self.id = source_id
+        self.requests = []
+
+    async def request(self, address, command, **kwargs):
+        self.requests.append((address, command, kwargs))
+        return None
+
+
+class FakeHub:
+    # Just enough of a hub for plugins: broadcasts are recorded instead of sealed and sent
+    store = None
+
+    def __init__(self):
+        self.connections = FanOut()
+        self.broadcasts = []
+
+    def has_subscribers(self, label):
+        return True
+
+    def needs_keyframe(self, label):
+        return self.connections.take_gap(label)
+
+    async def broadcast(self, payload, label=None, coalesce=True):
+        self.broadcasts.append((label, payload))
+
+
+@pytest.fixture
+def hub():
+    return FakeHub()
+
+
+@pytest.fixture
+def run():
+    def run(coroutine):
+        return asyncio.run(coroutine)
+    return run
+
+
+def get_parser(sections=None):
+    private_key = PrivateKey.generate()
+    signing_key = SigningKey.generate()
+
+    config = ConfigParser(interpolation=KeyInterpolation())
+    config.read_dict({
+        'hub': {},
+        'keys': {
+            'server_private_key': private_key.encode(Base64Encoder).decode('utf-8'),
+            'server_public_key': private_key.public_key.encode(Base64Encoder).decode('utf-8'),
+            'facade_signing_key': signing_key.encode(Base64Encoder).decode('utf-8'),
+        },
+    })
+    config.read_dict(sections or {})
+    return config
+
+
+def get_config(sections=None):
+    return RuntimeConfig(get_parser(sections))
+
+
+class FakeClient:
+    # A facade connection, frames are opened with its key as they are sent
+    def __init__(self, hub):
+        self.private_key = PrivateKey.generate()
+        self.public_key = self.private_key.public_key
+        self.box = Box(self.private_key, hub.config['keys']['server_public_key'])
+        self.group_boxes = {}
+        self.frames = []
+
+    async def send(self, frame):
+        message = flynn.loads(bytes(frame))
+        if 'key' in message:
+            payload = flynn.loads(self.box.decrypt(message['payload'], message['nonce']))
+        else:
+            payload = flynn.loads(self.group_boxes[message['group']].decrypt(message['payload'], message['nonce']))
+        self.frames.append(payload)
@@ -0,0 +1,183 @@
+import asyncio
+import socket
+
+import flynn
+import websockets
+
+from bench.bridge import FakeBridge
+from hub.sources.bridge import BridgeSource
+
+
+class FakeHub:
+    def __init__(self):
+        self.incoming = []
+
+    async def handle_connect(self, source):
+        pass
+
+    async def handle_incoming(self, source, message):
+        self.incoming.append((source.id, message))
+
+
+async def wait_for(condition, timeout=5.0):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'Timed out'
+        await asyncio.sleep(0.01)
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_source(url, **kwargs):
+    return BridgeSource('bridge', url, timeout=1.0, backoff=0.01, max_backoff=0.05, **kwargs)
+
+
+def test_request_and_messages_through_a_stand_in_bridge(run):
+    async def check():
+        bridge = FakeBridge(port=0, rate=50)
+        server = await bridge.start()
+        hub = FakeHub()
+        source = get_source(bridge.url)
+        task = asyncio.ensure_future(source.get_task(hub))
+        try:
+            assert await source.request(4, 'solar.get') == {'solar': bridge.solar}
+            await wait_for(lambda: len(hub.incoming) >= 3)
+            assert set(message['name'] for _, message in hub.incoming) == {'p1', 'solar', 'dht'}
+        finally:
+            task.cancel()
+            server.close()
+    run(check())
+
+
+def test_reconnects_after_garbage_from_the_bridge(run):
+    async def check():
+        connections = []
+
+        async def handle(connection, path=None):
+            connections.append(connection)
+            if len(connections) == 1:
+                await connection.send(b'\xff\xff not cbor')
+                await asyncio.sleep(1)
+                return
+            async for frame in connection:
+                message = flynn.loads(frame)
+                await connection.send(flynn.dumps({'id': message['id'], 'data': {'ok': 1}}))
+
+        server = await websockets.serve(handle, '127.0.0.1', 0)
+        source = get_source('ws://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1]))
+        task = asyncio.ensure_future(source.get_task(FakeHub()))
+        try:
+            await wait_for(lambda: len(connections) >= 2)
+            assert await source.request(1, 'ping') == {'ok': 1}
+            assert source.reconnects >= 1 and not task.done()
+        finally:
+            task.cancel()
+            server.close()
+    run(check())
+
+
+def test_backoff_applies_after_a_connection_that_drops_right_away(run):
+    async def check():
+        connections = []
+
+        async def handle(connection, path=None):
+            connections.append(asyncio.get_event_loop().time())
+
+        server = await websockets.serve(handle, '127.0.0.1', 0)
+        source = BridgeSource('bridge', 'ws://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1]),
+                              backoff=0.1, max_backoff=0.4)
+        task = asyncio.ensure_future(source.get_task(FakeHub()))
+        try:
+            await asyncio.sleep(0.5)
+            # Without backoff this would be hundreds
+            assert 1 <= len(connections) <= 5
+        finally:
+            task.cancel()
+            server.close()
+    run(check())
+
+
+def test_failed_requests_are_not_sent_after_reconnecting(run):
+    async def check():
+        source = get_source('ws://127.0.0.1:1', idempotent=('solar.get',))
+
+        requests = [
+            asyncio.ensure_future(source.request(4, 'solar.set', solar=1)),
+            asyncio.ensure_future(source.request(4, 'solar.get')),
+        ]
+        await source.command(4, 'otamode')
+        await asyncio.sleep(0)
+
+        source.fail_pending()
+        assert await requests[0] is None
+        queued = [source.outgoing.get_nowait()[0]['name'] for _ in range(source.outgoing.qsize())]
+        assert queued == ['solar.get']
+        requests[1].cancel()
+        await asyncio.gather(requests[1], return_exceptions=True)
+    run(check())
+
+
+def test_replayable_requests_are_sent_once_after_reconnecting(run):
+    async def check():
+        frames = []
+
+        async def handle(connection, path=None):
+            async for frame in connection:
+                message = flynn.loads(frame)
+                frames.append(message['name'])
+                if len(frames) == 1:
+                    # Drop the connection without answering the first one
+                    await connection.close()
+                    return
+                await connection.send(flynn.dumps({'id': message['id'], 'data': {'solar': 1}}))
+
+        server = await websockets.serve(handle, '127.0.0.1', 0)
+        source = get_source('ws://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1]),
+                            idempotent=('solar.get',))
+        task = asyncio.ensure_future(source.get_task(FakeHub()))
+        try:
+            assert await source.request(4, 'solar.get') == {'solar': 1}
+            assert frames == ['solar.get', 'solar.get']
+        finally:
+            task.cancel()
+            server.close()
+    run(check())
+
+
+def test_requests_that_timed_out_are_not_sent_after_reconnecting(run):
+    async def check():
+        frames = []
+
+        async def handle(connection, path=None):
+            async for frame in connection:
+                message = flynn.loads(frame)
+                frames.append(message['name'])
+                await connection.send(flynn.dumps({'id': message['id'], 'data': {}}))
+
+        # Nothing listens yet, the requests time out while queued
+        port = get_free_port()
+        source = BridgeSource('bridge', 'ws://127.0.0.1:{}'.format(port), timeout=0.05,
+                              backoff=0.01, max_backoff=0.05, idempotent=('solar.get',))
+        task = asyncio.ensure_future(source.get_task(FakeHub()))
+        try:
+            assert await source.request(4, 'solar.set', solar=1) is None
+            assert await source.request(4, 'solar.get') is None
+            cancelled = asyncio.ensure_future(source.request(4, 'solar.set', solar=2))
+            await asyncio.sleep(0.01)
+            cancelled.cancel()
+
+            server = await websockets.serve(handle, '127.0.0.1', port)
+            try:
+                source.timeout = 1.0
+                assert await source.request(4, 'ota.end') == {}
+                assert frames == ['ota.end']
+            finally:
+                server.close()
+        finally:
+            task.cancel()
+    run(check())
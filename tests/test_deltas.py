@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from hub.cbor import Encoded
+from hub.fanout import FanOut
+from hub.plugins.base import Plugin
+
+
+class CountingPlugin(Plugin):
+    label = 'counting'
+    delta = True
+
+
+class BlockedClient:
+    async def send(self, frame):
+        await asyncio.Event().wait()
+
+
+def get_frames(hub):
+    return ['keyframe' if isinstance(payload, Encoded) else payload for _, payload in hub.broadcasts]
+
+
+def test_removed_keys_are_sent_as_tombstones(run, hub):
+    async def check():
+        plugin = CountingPlugin('counting', hub)
+        await plugin.broadcast({'a': 1, 'b': 2})
+        await plugin.broadcast({'a': 1, 'c': 3})
+        await plugin.broadcast({'c': 3})
+        assert get_frames(hub) == [
+            'keyframe',
+            {'label': 'counting', 'sequence': 1, 'delta': {'c': 3}, 'removed': ['b']},
+            {'label': 'counting', 'sequence': 2, 'delta': {}, 'removed': ['a']},
+        ]
+    run(check())
+
+
+def test_lists_losing_items_get_a_keyframe(run, hub):
+    async def check():
+        plugin = CountingPlugin('counting', hub)
+        await plugin.broadcast([1, 2])
+        await plugin.broadcast([1, 2, 3])
+        await plugin.broadcast([2, 3])
+        assert get_frames(hub) == [
+            'keyframe', {'label': 'counting', 'sequence': 1, 'delta': [3]}, 'keyframe',
+        ]
+    run(check())
+
+
+def test_dropped_frames_are_followed_by_a_keyframe(run, hub):
+    async def check():
+        fanout = FanOut(maxsize=1)
+        fanout.add(BlockedClient())
+        await asyncio.sleep(0)
+        for frame in (b'1', b'2', b'3'):
+            fanout.broadcast(frame, 'counting', coalesce=False)
+        assert fanout.dropped and fanout.gaps == {'counting'}
+
+        hub.connections = fanout
+        plugin = CountingPlugin('counting', hub)
+        await plugin.broadcast({'a': 1})
+        await plugin.broadcast({'a': 2})
+        fanout.gaps.add('counting')
+        await plugin.broadcast({'a': 3})
+        await plugin.broadcast({'a': 4})
+        assert get_frames(hub) == [
+            'keyframe',
+            {'label': 'counting', 'sequence': 1, 'delta': {'a': 2}},
+            'keyframe',
+            {'label': 'counting', 'sequence': 3, 'delta': {'a': 4}},
+        ]
+        assert not fanout.gaps
+    run(check())
+
+
+def test_failed_rate_limited_broadcasts_are_logged(run, hub, caplog):
+    async def check():
+        async def broken(payload, label=None, coalesce=True):
+            raise RuntimeError('Broken')
+
+        plugin = CountingPlugin('counting', hub)
+        plugin.max_rate = 100
+        await plugin.broadcast({'a': 1})
+        hub.broadcast = broken
+        await plugin.broadcast({'a': 2})
+        await asyncio.sleep(0.05)
+        assert plugin.pending_task is None
+    with caplog.at_level(logging.ERROR):
+        run(check())
+    assert [record.getMessage() for record in caplog.records] == ['Plugin counting failed to broadcast']
+
+
+def test_lists_of_records_are_updated_by_id(run, hub):
+    async def check():
+        plugin = CountingPlugin('counting', hub)
+        await plugin.broadcast([{'id': 31, 'power': 1}, {'id': 141, 'power': 2}])
+        await plugin.broadcast([{'id': 31, 'power': 3}, {'id': 141, 'power': 2}])
+        await plugin.broadcast([{'id': 141, 'power': 4}])
+        assert get_frames(hub) == [
+            'keyframe',
+            {'label': 'counting', 'sequence': 1, 'delta': [{'id': 31, 'power': 3}]},
+            {'label': 'counting', 'sequence': 2, 'delta': [{'id': 141, 'power': 4}], 'removed': [31]},
+        ]
+    run(check())
+
+
+def test_windcentrale_updates_are_deltas(run, hub):
+    from hub.plugins.windcentrale import WindcentralePlugin
+
+    async def check():
+        plugin = WindcentralePlugin('windcentrale', hub, [(31, 2), (141, 1)])
+        plugin.delta = True
+        for mill, per_share in ((31, 10), (141, 20), (31, 11), (141, 21)):
+            await plugin.on_source_message(None, {'name': 'windmill', 'data': {
+                'id': mill, 'per_share': per_share, 'performance': 50,
+            }})
+        frames = get_frames(hub)
+        assert frames[0] == 'keyframe'
+        assert [[mill['id'] for mill in frame['delta']] for frame in frames[1:]] == [[141], [31], [141]]
+    run(check())
@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from hub.plugins.history import HistoryPlugin  # noqa: E402
+from hub.store import Store  # noqa: E402
+
+
+class Client:
+    pass
+
+
+@pytest.fixture
+def history(hub, tmp_path):
+    hub.store = Store(str(tmp_path))
+    for i in range(20):
+        hub.store.append('dht', 'temperature', i, i * 1000)
+    hub.store.flush()
+
+    plugin = HistoryPlugin('history', hub, [5000])
+    replies = []
+
+    async def reply(client, client_key, content):
+        replies.append(content)
+    plugin.reply = reply
+    return plugin, replies
+
+
+@pytest.mark.parametrize('end', [12000, 15000, 17500, 25000])
+def test_cached_matches_uncached(history, end):
+    plugin, _ = history
+    # The first call fills the cache, the second is served from it
+    plugin.get_summary('dht', 'temperature', 0, 20000, 5000)
+    cached = plugin.get_summary('dht', 'temperature', 0, end, 5000).as_dict()
+
+    plugin.resolutions = set()
+    assert cached == plugin.get_summary('dht', 'temperature', 0, end, 5000).as_dict()
+
+
+def test_partial_bucket_at_the_end(history):
+    plugin, _ = history
+    plugin.get_summary('dht', 'temperature', 0, 20000, 5000)
+    summary = plugin.get_summary('dht', 'temperature', 0, 12000, 5000).as_dict()
+    assert summary['timestamp'][-1] == 10000
+    assert summary['max'][-1] == 11
+    assert summary['count'][-1] == 2
+
+
+@pytest.mark.parametrize('request_', [
+    {'target': 'history', 'series': 'temperature', 'start': 0, 'end': 1000},
+    {'target': 'history', 'label': 'dht', 'series': 'unknown', 'start': 0, 'end': 1000},
+    {'target': 'history', 'label': ['dht'], 'series': 'temperature', 'start': 0, 'end': 1000},
+])
+def test_unknown_series_are_refused(history, run, tmp_path, request_):
+    plugin, replies = history
+    run(plugin.on_client_request(Client(), None, request_))
+    assert replies == [{'error': 'Unknown series'}]
+    assert not (tmp_path / 'dht' / 'unknown.ts').exists()
+    assert set(plugin.hub.store.series) == {('dht', 'temperature')}
+
+
+def test_cache_starts_at_the_requested_range(history):
+    plugin, _ = history
+    series = plugin.hub.store.get_series('dht', 'temperature')
+    read = series.read
+    reads = []
+
+    def record(start=None, end=None):
+        reads.append((start, end))
+        return read(start, end)
+    series.read = record
+
+    plugin.get_summary('dht', 'temperature', 10000, 20000, 5000)
+    # The cached bucket, then the samples after it
+    assert reads == [(10000, None), (15000, 20000)]
+    cached = plugin.summaries[('dht', 'temperature', 5000)]
+    assert cached.summary.timestamp.tolist() == [10000]
+
+    # Earlier buckets are added when asked for, without reading past what is cached already
+    reads.clear()
+    summary = plugin.get_summary('dht', 'temperature', 2000, 20000, 5000).as_dict()
+    assert reads[0] == (0, 10000)
+    assert cached.summary.timestamp.tolist() == [0, 5000, 10000]
+
+    plugin.resolutions = set()
+    assert summary == plugin.get_summary('dht', 'temperature', 2000, 20000, 5000).as_dict()
@@ -0,0 +1,55 @@
+import asyncio
+
+from hub import Hub
+
+from .conftest import FakeSource, get_config
+
+
+class SlowPlugin:
+    id = 'slow'
+
+    def __init__(self):
+        self.handled = []
+        self.running = 0
+        self.most_running = 0
+
+    async def on_source_message(self, source, message):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(0.01)
+        self.handled.append(message['sequence'])
+        self.running -= 1
+
+
+class FailingPlugin:
+    id = 'failing'
+
+    def __init__(self):
+        self.handled = []
+
+    async def on_source_message(self, source, message):
+        self.handled.append(message['sequence'])
+        raise RuntimeError('Broken plugin')
+
+
+def test_messages_are_handled_in_order_with_a_bounded_backlog(run):
+    async def check():
+        hub = Hub(get_config({'hub': {'incoming_queue': '4'}}))
+        slow, failing = SlowPlugin(), FailingPlugin()
+        hub.get_handlers = lambda source, name: [slow, failing]
+
+        source = FakeSource()
+        for sequence in range(10):
+            await hub.handle_incoming(source, {'name': 'dht', 'sequence': sequence})
+        assert len(hub.handlers) == 2
+
+        while hub.handlers:
+            await asyncio.sleep(0.01)
+
+        # The slow one only got to the newest few, the failing one kept going after each failure
+        assert slow.handled == [6, 7, 8, 9]
+        assert slow.most_running == 1
+        assert failing.handled == [6, 7, 8, 9]
+        assert hub.incoming_dropped == 12
+        assert not hub.inboxes
+    run(check())
@@ -0,0 +1,44 @@
+import threading
+
+from hub import Hub
+from hub.metrics import Metrics
+
+from .conftest import get_config
+
+
+def test_source_stats_are_exposed_as_gauges(run):
+    async def check():
+        hub = Hub(get_config({
+            'hub': {'sources': 'bridge'},
+            'bridge': {'url': 'ws://127.0.0.1:1'},
+        }))
+        source = hub.sources['bridge']
+        hub.start_source(source)
+        source.timeouts = 3
+
+        rendered = hub.metrics.render()
+        assert 'source_timeouts{source="bridge"} 3' in rendered
+        assert 'source_requests_per_second{source="bridge"} 0.0' in rendered
+
+        hub.stop_source('bridge')
+        assert 'source_timeouts' not in hub.metrics.render()
+    run(check())
+
+
+def test_histograms_can_be_observed_from_threads():
+    metrics = Metrics(enabled=True)
+
+    def observe():
+        for i in range(10000):
+            metrics.observe('hub_crypto_seconds', 0.001, operation='seal')
+            metrics.observe('hub_crypto_seconds', 0.001, operation='thread{}'.format(i % 7))
+
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    histogram = metrics.get_histogram('hub_crypto_seconds', {'operation': 'seal'})
+    assert histogram.count == sum(histogram.counts) == 80000
+    assert 'hub_crypto_seconds_count{operation="seal"} 80000' in metrics.render()
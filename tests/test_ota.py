@@ -0,0 +1,121 @@
+import asyncio
+from io import StringIO
+
+from intelhex import IntelHex
+
+from hub import Hub
+from hub.firmware import FirmwareCache
+from hub.plugins.ota import OtaPlugin
+
+from .conftest import FakeClient, get_config
+
+
+class OtaSource:
+    id = 'bridge'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.blocks = []
+
+    async def command(self, target_address, name, **kwargs):
+        pass
+
+    async def request(self, target_address, name, **kwargs):
+        if name == 'ota.block':
+            self.blocks.append(kwargs['memaddr'])
+            if kwargs['memaddr'] in self.failing:
+                return None
+            # Give concurrent requests a chance to come in
+            await asyncio.sleep(0.001)
+        return {}
+
+
+def get_hex(data):
+    hex_file = IntelHex()
+    hex_file.puts(0, data)
+    output = StringIO()
+    hex_file.write_hex_file(output)
+    return output.getvalue().encode('utf-8')
+
+
+def get_plugin(hub, source, path=None):
+    hub.get_source = lambda address, default=None: default
+    plugin = OtaPlugin('ota', hub, source, FirmwareCache(path), block_size=16, retries=2, retry_delay=0)
+    plugin.replies = []
+
+    async def reply(client, client_key, content):
+        plugin.replies.append(content)
+    plugin.reply = reply
+    return plugin
+
+
+def test_a_new_request_starts_a_fresh_transfer(run, hub):
+    async def check():
+        source = OtaSource(failing=(16,))
+        plugin = get_plugin(hub, source)
+        data = get_hex(bytes(range(64)))
+
+        await plugin.program(None, None, 5, data)
+        assert plugin.replies[-1]['state'] == 'failed'
+        # Retries within the transfer only send what wasn't acknowledged
+        assert sorted(source.blocks) == [0, 16, 16, 32, 48]
+
+        source.failing.clear()
+        source.blocks.clear()
+        await plugin.program(None, None, 5, data)
+        assert plugin.replies[-1] == {'address': 5, 'state': 'done', 'sent': 4, 'total': 4}
+        assert sorted(source.blocks) == [0, 16, 32, 48]
+        assert not plugin.transfers
+    run(check())
+
+
+def test_one_transfer_per_address(run, hub):
+    async def check():
+        plugin = get_plugin(hub, OtaSource())
+        data = get_hex(bytes(range(64)))
+
+        await asyncio.gather(plugin.program(None, None, 5, data), plugin.program(None, None, 5, data))
+        states = [reply['state'] for reply in plugin.replies]
+        assert states.count('done') == 1
+        assert {'address': 5, 'state': 'failed', 'error': 'Already programming'} in plugin.replies
+    run(check())
+
+
+def test_flashed_images_survive_a_restart(run, hub, tmp_path):
+    async def check():
+        plugin = get_plugin(hub, OtaSource(), str(tmp_path))
+        await plugin.program(None, None, 5, get_hex(bytes(range(64))))
+
+        cache = FirmwareCache(str(tmp_path))
+        image = await cache.last_flashed(5)
+        assert image.data == bytes(range(64))
+
+        # Only the changed block goes out the next time
+        source = OtaSource()
+        plugin = get_plugin(hub, source, str(tmp_path))
+        await plugin.program(None, None, 5, get_hex(bytes(range(32)) + b'\0' * 16 + bytes(range(48, 64))))
+        assert source.blocks == [32]
+    run(check())
+
+
+def test_flashing_goes_on_without_the_client(run):
+    async def check():
+        hub = Hub(get_config())
+        source = OtaSource()
+        source.requests = []
+        request = source.request
+
+        async def record(target_address, name, **kwargs):
+            source.requests.append(name)
+            return await request(target_address, name, **kwargs)
+        source.request = record
+
+        plugin = OtaPlugin('ota', hub, source, FirmwareCache(), block_size=16, retries=2, retry_delay=0)
+        # Never in the hub's connections, like a client that disconnected halfway
+        client = FakeClient(hub)
+
+        await plugin.program(client, client.public_key, 5, get_hex(bytes(range(64))))
+        assert source.requests[-1] == 'ota.end'
+        assert len(source.blocks) == 4
+        assert not client.frames
+    run(check())
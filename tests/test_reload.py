@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+from nacl.encoding import Base64Encoder
+
+from hub import Hub
+from hub.config import load_config
+
+from .conftest import FakeClient, get_parser
+
+
+def write_config(path, parser):
+    with open(path, 'w') as f:
+        parser.write(f)
+
+
+def get_hub(tmp_path, sections=None):
+    path = str(tmp_path / 'hemma.conf')
+    parser = get_parser(sections)
+    write_config(path, parser)
+    return Hub(load_config(path)), parser, path
+
+
+def test_malformed_config_keeps_the_current_one(run, tmp_path):
+    async def check():
+        hub, parser, path = get_hub(tmp_path)
+        with open(path, 'w') as f:
+            f.write('no section header\n')
+        assert hub.reload() is None
+        assert 'keys' in hub.config
+    run(check())
+
+
+def test_restart_only_changes_are_logged(run, tmp_path, caplog):
+    async def check():
+        hub, parser, path = get_hub(tmp_path)
+        parser['hub']['send_queue'] = '8'
+        parser['hub']['plugins'] = 'dht'
+        write_config(path, parser)
+
+        with caplog.at_level(logging.WARNING, logger='hub'):
+            assert hub.reload() == {'dht'}
+        assert [record.getMessage() for record in caplog.records] == ['Changes to [hub] take effect after a restart']
+    run(check())
+
+
+def test_plugins_are_rebuilt_with_a_replaced_source(run, tmp_path):
+    async def check():
+        hub, parser, path = get_hub(tmp_path, {
+            'hub': {'sources': 'bridge', 'plugins': 'solar dht'},
+            'bridge': {'url': 'ws://127.0.0.1:1'},
+        })
+        solar, dht = hub.plugins['solar'], hub.plugins['dht']
+
+        parser['bridge']['url'] = 'ws://127.0.0.1:2'
+        write_config(path, parser)
+        assert hub.reload() == {'bridge', 'solar'}
+        assert hub.plugins['solar'] is not solar and hub.plugins['dht'] is dht
+        assert hub.plugins['solar'].source_target is hub.sources['bridge']
+
+        for task in hub.source_tasks.values():
+            task.cancel()
+    run(check())
+
+
+def test_reload_request_needs_an_admin_key(run, tmp_path):
+    async def check():
+        hub, parser, path = get_hub(tmp_path)
+        admin, other = FakeClient(hub), FakeClient(hub)
+        hub.connections.add(admin)
+        hub.connections.add(other)
+        parser['keys']['admin_public_keys'] = admin.public_key.encode(Base64Encoder).decode('utf-8')
+        write_config(path, parser)
+        hub.reload()
+
+        await hub.handle_hub_request(other, other.public_key, {'target': 'hub', 'command': 'reload'})
+        await asyncio.sleep(0)
+        assert other.frames == [{'label': 'hub', 'error': 'Not allowed'}]
+
+        await hub.handle_hub_request(admin, admin.public_key, {'target': 'hub', 'command': 'reload'})
+        await asyncio.sleep(0)
+        assert admin.frames == [{'label': 'hub', 'data': {'reloaded': []}}]
+    run(check())
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from bench.bridge import FakeBridge
+from hub import Hub
+
+from .conftest import get_config
+from .test_bridge import wait_for
+
+
+def get_hub(bridges, plugins='solar ota', **sections):
+    config = {'hub': {'sources': ' '.join(name for name in bridges), 'plugins': plugins}}
+    for name, (bridge, addresses) in bridges.items():
+        config[name] = {'module': 'bridge', 'url': bridge.url, 'addresses': addresses,
+                        'backoff': '0.01', 'max_backoff': '0.05'}
+    config.update(sections)
+    return Hub(get_config(config))
+
+
+def test_messages_and_requests_go_to_the_bridge_serving_the_address(run):
+    async def check():
+        first, second = FakeBridge(port=0, rate=50), FakeBridge(port=0, rate=50)
+        # Tells apart which bridge the solar readings came from
+        second.solar = 1000
+        servers = [await first.start(), await second.start()]
+
+        hub = get_hub({'bridge': (first, '4'), 'bridge1': (second, '5')}, solar={'address': '5'})
+        solar, ota = hub.plugins['solar'], hub.plugins['ota']
+        assert solar.source_target is hub.sources['bridge1']
+        assert solar.dependencies == ('bridge1',)
+
+        for source in hub.sources.values():
+            hub.start_source(source)
+        try:
+            # Asked for its value on connect, then fed by its own bridge only
+            await wait_for(lambda: second.requests and len(solar.samples) > 5)
+            assert first.requests == 0
+            assert all(value >= 1000 for _, value in solar.samples.items())
+
+            requests = second.requests
+            assert await ota.start(5)
+            assert (first.requests, second.requests) == (0, requests + 1)
+            assert await ota.start(4)
+            assert first.requests == 1
+
+            # Nodes without a route go through the configured default
+            assert ota.get_source(9) is hub.sources['bridge']
+        finally:
+            for task in hub.source_tasks.values():
+                task.cancel()
+            for server in servers:
+                server.close()
+    run(check())
+
+
+def test_ota_without_the_default_source(run):
+    async def check():
+        bridge = FakeBridge(port=0)
+        hub = get_hub({'bridge1': (bridge, '5')}, plugins='ota')
+        ota = hub.plugins['ota']
+        assert ota.get_source(5) is hub.sources['bridge1']
+        assert ota.get_source(9) is None
+    run(check())
+
+
+def test_solar_without_a_source_is_a_config_error(run):
+    async def check():
+        bridge = FakeBridge(port=0)
+        with pytest.raises(ValueError, match='No source for solar address 4'):
+            get_hub({'bridge1': (bridge, '5')}, plugins='solar')
+    run(check())
+
+
+def test_addresses_claimed_twice_are_a_config_error(run):
+    async def check():
+        first, second = FakeBridge(port=0), FakeBridge(port=0)
+        with pytest.raises(ValueError, match="Address 4 is claimed by both"):
+            get_hub({'bridge': (first, '4'), 'bridge1': (second, '4 5')}, plugins='')
+    run(check())
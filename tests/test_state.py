@@ -0,0 +1,77 @@
+import pytest
+
+from hub.plugins.dht import DHTPlugin
+from hub.plugins.p1 import P1Plugin
+from hub.plugins.solar import SolarPlugin
+from hub.state import StateStore
+
+from .conftest import FakeSource
+
+P1_DATA = {'e_d_1': 1000.125, 'e_d_2': 2000.5, 'e_r_1': 10.25, 'e_r_2': 20.0, 'p_d': 0.512, 'p_r': 0.1, 'g_d': 300.75}
+
+
+def round_trip(tmp_path, plugin, restored):
+    StateStore(str(tmp_path / 'state.json')).save({plugin.id: plugin})
+    StateStore(str(tmp_path / 'state.json')).restore({restored.id: restored})
+    return restored
+
+
+def test_p1_round_trip(tmp_path, hub, run):
+    plugin = P1Plugin('p1', hub)
+    run(plugin.update_p1(P1_DATA))
+    run(plugin.update_p1(dict(P1_DATA, p_d=0.75)))
+
+    restored = round_trip(tmp_path, plugin, P1Plugin('p1', hub))
+    assert restored.readings == plugin.readings
+    assert restored.snapshot.content == plugin.snapshot.content
+    assert list(restored.consumption.items()) == list(plugin.consumption.items())
+
+
+def test_dht_round_trip(tmp_path, hub, run):
+    plugin = DHTPlugin('dht', hub)
+    run(plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 20.5, 'humidity': 40.25}}))
+
+    restored = round_trip(tmp_path, plugin, DHTPlugin('dht', hub))
+    assert restored.snapshot.content == {'temperature': 20.5, 'humidity': 40.25}
+    assert restored.timestamp == pytest.approx(plugin.timestamp, abs=0.001)
+
+
+def test_solar_round_trip(tmp_path, hub, run):
+    plugin = SolarPlugin('solar', hub, FakeSource())
+    for value in (100, 110.5, 125):
+        run(plugin.update_solar(value))
+
+    restored = round_trip(tmp_path, plugin, SolarPlugin('solar', hub, FakeSource()))
+    assert restored.readings == plugin.readings
+    assert list(restored.samples.items()) == list(plugin.samples.items())
+
+
+def test_windcentrale_round_trip(tmp_path, hub, run):
+    pytest.importorskip('aiohttp')
+    from hub.plugins.windcentrale import WindcentralePlugin
+
+    plugin = WindcentralePlugin('windcentrale', hub, [(31, 2)])
+    run(plugin.on_source_message(None, {'name': 'windmill', 'data': {'id': 31, 'per_share': 1.5, 'performance': 0.4}}))
+
+    restored = round_trip(tmp_path, plugin, WindcentralePlugin('windcentrale', hub, [(31, 2)]))
+    assert restored.snapshot.content == plugin.snapshot.content
+
+
+def test_unchanged_state_is_not_written_again(tmp_path, hub, run):
+    plugin = DHTPlugin('dht', hub)
+    run(plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 20}}))
+
+    store = StateStore(str(tmp_path / 'state.json'))
+    store.save({plugin.id: plugin})
+    (tmp_path / 'state.json').unlink()
+    store.save({plugin.id: plugin})
+    assert not (tmp_path / 'state.json').exists()
+
+
+@pytest.mark.parametrize('content', [b'\xa1\xfb\x00', b'{"dht": {"state": ', b'[1, 2]'])
+def test_bad_state_file_starts_empty(tmp_path, hub, content):
+    (tmp_path / 'state.json').write_bytes(content)
+
+    plugin = DHTPlugin('dht', hub)
+    StateStore(str(tmp_path / 'state.json')).restore({plugin.id: plugin})
+    assert plugin.snapshot is None
@@ -0,0 +1,32 @@
+import asyncio
+
+import flynn
+import websockets
+from nacl.public import PrivateKey
+
+from hub import Hub
+
+from .conftest import get_config
+from .test_bridge import get_free_port
+
+
+def test_facades_can_connect_to_the_local_servers(run):
+    async def check():
+        auth_port, stream_port = get_free_port(), get_free_port()
+        hub = Hub(get_config({
+            'local_auth': {'host': '127.0.0.1', 'port': str(auth_port)},
+            'local_stream': {'host': '127.0.0.1', 'port': str(stream_port)},
+        }))
+        await hub.get_local_auth()
+        await hub.get_local_stream()
+
+        public_key = PrivateKey.generate().public_key.encode()
+        async with websockets.connect('ws://127.0.0.1:{}'.format(auth_port)) as auth:
+            await auth.send(public_key)
+            reply = flynn.loads(await auth.recv())
+        assert reply['key'] == hub.config['keys']['server_public_key'].encode()
+
+        async with websockets.connect('ws://127.0.0.1:{}'.format(stream_port)):
+            await asyncio.sleep(0.05)
+            assert len(hub.connections) == 1
+    run(check())
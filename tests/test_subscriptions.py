@@ -0,0 +1,92 @@
+import asyncio
+
+from nacl.secret import SecretBox
+
+from hub import Hub
+from hub.plugins.dht import DHTPlugin
+from hub.upstream import UpstreamChannel
+
+from .conftest import FakeClient, get_config
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, frame):
+        self.frames.append(frame)
+
+
+def test_disconnected_upstream_is_no_subscriber(run):
+    async def check():
+        hub = Hub(get_config())
+        channel = UpstreamChannel(hub.connections)
+        hub.connections.add(channel, channel)
+        assert not hub.has_subscribers('dht')
+
+        await channel.attach(FakeWebsocket())
+        assert hub.has_subscribers('dht')
+
+        channel.detach()
+        assert not hub.has_subscribers('dht')
+    run(check())
+
+
+def test_nothing_is_encoded_without_subscribers(run, monkeypatch):
+    async def check():
+        hub = Hub(get_config())
+        plugin = DHTPlugin('dht', hub)
+        sealed = []
+        monkeypatch.setattr(hub, 'seal', lambda *args, **kwargs: sealed.append(args) or b'')
+
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 20}})
+        assert plugin.snapshot._encoded is None and plugin.snapshot._payload is None
+        assert not sealed
+
+        hub.connections.add(FakeWebsocket())
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 21}})
+        assert sealed
+    run(check())
+
+
+def test_subscribing_sends_state_before_deltas(run):
+    async def check():
+        hub = Hub(get_config())
+        plugin = hub.plugins['dht'] = DHTPlugin('dht', hub)
+        plugin.delta = True
+        client = FakeClient(hub)
+        hub.connections.add(client)
+
+        await hub.subscribe(client, client.public_key, frozenset(['p1']))
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 20, 'humidity': 40}})
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 21, 'humidity': 40}})
+        await asyncio.sleep(0)
+        assert [frame['data']['labels'] for frame in client.frames] == [['p1']]
+
+        await hub.subscribe(client, client.public_key, frozenset(['p1', 'dht']))
+        await asyncio.sleep(0)
+        subscribed, snapshot = client.frames[1:]
+        client.group_boxes[subscribed['data']['group']] = SecretBox(subscribed['data']['key'])
+        assert snapshot['data']['labels'] == {'dht': {'temperature': 21, 'humidity': 40}}
+
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 22, 'humidity': 40}})
+        await plugin.on_source_message(None, {'name': 'dht', 'data': {'temperature': 23, 'humidity': 40}})
+        await asyncio.sleep(0)
+        keyframe, delta = client.frames[3:]
+        assert keyframe['data'] == {'temperature': 22, 'humidity': 40}
+        assert delta['delta'] == {'temperature': 23}
+    run(check())
+
+
+def test_subscribe_rejects_anything_but_a_list_of_strings(run):
+    async def check():
+        hub = Hub(get_config())
+        client = FakeClient(hub)
+        channel = hub.connections.add(client)
+
+        for labels in ('p1', [1, 2], {'p1': True}):
+            await hub.handle_hub_request(client, client.public_key, {'command': 'subscribe', 'labels': labels})
+        await asyncio.sleep(0)
+        assert channel.labels is None
+        assert [frame['error'] for frame in client.frames] == ['labels should be a list of strings'] * 3
+    run(check())
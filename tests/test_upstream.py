@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import flynn
+
+from hub.fanout import FanOut
+from hub.upstream import Spool, UpstreamChannel
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, frame):
+        self.frames.append(frame)
+
+
+def get_channel(**kwargs):
+    fanout = FanOut()
+    channel = UpstreamChannel(fanout, **kwargs)
+    fanout.add(channel, channel)
+    return fanout, channel
+
+
+async def settle(channel):
+    while channel.frames:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+
+
+def test_frames_are_sent_as_is_by_default(run):
+    async def check():
+        fanout, channel = get_channel()
+        websocket = FakeWebsocket()
+        await channel.attach(websocket)
+
+        for i in range(3):
+            fanout.broadcast(b'frame %d' % i, 'p1', coalesce=False)
+        await settle(channel)
+        assert websocket.frames == [b'frame 0', b'frame 1', b'frame 2']
+    run(check())
+
+
+def test_batches_when_enabled(run):
+    async def check():
+        fanout, channel = get_channel(batch_window=0.01, batch_size=64)
+        websocket = FakeWebsocket()
+        await channel.attach(websocket)
+
+        for i in range(3):
+            fanout.broadcast(b'frame %d' % i, 'p1', coalesce=False)
+        fanout.send(channel, b'reply')
+        await settle(channel)
+        assert websocket.frames == [flynn.dumps({'batch': [b'frame 0', b'frame 1', b'frame 2']}), b'reply']
+    run(check())
+
+
+def test_spooled_while_disconnected_and_replayed_in_order(tmp_path, run):
+    async def check():
+        fanout, channel = get_channel(spool=Spool(str(tmp_path), segment_size=16))
+        for i in range(5):
+            fanout.broadcast(b'frame %d' % i, 'p1', coalesce=False)
+        # A reply belongs to a connection that is gone, it isn't kept
+        fanout.send(channel, b'reply')
+        await settle(channel)
+        assert len(channel.spool) > 0
+
+        websocket = FakeWebsocket()
+        await channel.attach(websocket)
+        assert websocket.frames == [b'frame %d' % i for i in range(5)]
+        assert not channel.spool and not channel.spool.segments
+    run(check())
+
+
+def test_spool_budget_drops_oldest_segments(tmp_path):
+    spool = Spool(str(tmp_path), budget=64, segment_size=16)
+    for i in range(20):
+        spool.append(b'frame %02d' % i)
+    assert len(spool) <= 64 + 16
+
+    _, frames = spool.oldest()
+    assert frames[0] > b'frame 00'
+    assert Spool(str(tmp_path)).size == spool.size
+
+
+def test_attaching_waits_for_frames_being_spooled(tmp_path, run):
+    async def check():
+        fanout, channel = get_channel(spool=Spool(str(tmp_path)))
+        extend = channel.spool.extend
+
+        def slow_extend(frames):
+            time.sleep(0.05)
+            extend(frames)
+        channel.spool.extend = slow_extend
+
+        for i in range(3):
+            fanout.broadcast(b'frame %d' % i, 'p1', coalesce=False)
+        await asyncio.sleep(0.01)
+        assert not channel.spool
+
+        websocket = FakeWebsocket()
+        await channel.attach(websocket)
+        fanout.broadcast(b'frame 3', 'p1', coalesce=False)
+        await settle(channel)
+        assert websocket.frames == [b'frame %d' % i for i in range(4)]
+        assert not channel.spool
+    run(check())
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+
+from hub.sources.windcentrale import WindcentralSource  # noqa: E402
+
+from .test_bridge import wait_for  # noqa: E402
+
+
+class FakeHub:
+    def __init__(self):
+        self.incoming = []
+
+    async def handle_connect(self, source):
+        pass
+
+    async def handle_incoming(self, source, message):
+        self.incoming.append(message['data'])
+
+
+def get_line(wind, total):
+    return '{},{},{},{}\n'.format(wind, total, total // 10, 50).encode('utf-8')
+
+
+def test_only_the_latest_sample_per_mill_is_dispatched(run):
+    async def check():
+        source = WindcentralSource('windcentrale', [(31, 2), (141, 1)])
+        for total in (100, 110, 120):
+            source.add_sample(31, source.parse_line(31, get_line(5, total)))
+        source.add_sample(141, source.parse_line(141, get_line(3, 200)))
+        assert source.updated.qsize() == 2
+
+        hub = FakeHub()
+        task = asyncio.ensure_future(source.dispatch(hub))
+        try:
+            await wait_for(lambda: len(hub.incoming) == 2)
+            assert [(sample['id'], sample['mill_total']) for sample in hub.incoming] == [(31, 120), (141, 200)]
+        finally:
+            task.cancel()
+    run(check())
+
+
+def test_live_stream_is_retried_after_an_error(run):
+    async def check():
+        requests = []
+        streaming = asyncio.Event()
+        finished = asyncio.Event()
+
+        async def live(request):
+            requests.append(request.match_info['mill'])
+            if len(requests) == 1:
+                return web.Response(status=503)
+
+            response = web.StreamResponse()
+            await response.prepare(request)
+            await response.write(get_line(5, 100) + b'garbage\n')
+            await response.write(get_line(6, 110))
+            streaming.set()
+            await finished.wait()
+            return response
+
+        app = web.Application()
+        app.router.add_get('/live/{mill}', live)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        source = WindcentralSource('windcentrale', [(31, 2)], live_url='http://127.0.0.1:{}'.format(port) + '/live/{id}',
+                                   backoff=0.01, max_backoff=0.05)
+        hub = FakeHub()
+        task = asyncio.ensure_future(source.get_task(hub))
+        try:
+            await asyncio.wait_for(streaming.wait(), 5)
+            await wait_for(lambda: hub.incoming and hub.incoming[-1]['mill_total'] == 110)
+            assert requests == ['31', '31']
+            # Unparseable lines are skipped, the stream goes on
+            assert all(sample['id'] == 31 for sample in hub.incoming)
+        finally:
+            finished.set()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await runner.cleanup()
+    run(check())